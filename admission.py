@@ -0,0 +1,171 @@
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+
+def parse_weights(value):
+    """Parse "alice@example.com=2,bob@example.com=0.5" into {owner: weight}.
+
+    Raises ValueError for a weight that is not a positive number, since a user with
+    no share at all would never be scheduled.
+    """
+    weights = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            owner, weight = item.rsplit("=", 1)
+            owner = owner.strip().lower()
+            try:
+                weight = float(weight)
+            except ValueError:
+                raise ValueError(f"USER_WEIGHTS: weight for {owner} is not a number: {weight.strip()!r}") from None
+            if not weight > 0:
+                raise ValueError(f"USER_WEIGHTS: weight for {owner} must be greater than 0, got {weight:g}")
+            weights[owner] = weight
+    return weights
+
+
+class Ticket:
+    def __init__(self, owner, short, start_tag, not_before, sequence):
+        self.owner = owner
+        self.short = short
+        self.start_tag = start_tag
+        self.not_before = not_before
+        # Short requests first, then start-time fair queuing between users
+        self.key = (not short, start_tag, sequence)
+
+
+class AdmissionController:
+    """Fair share of the translation capacity between signed-in users.
+
+    At most capacity requests run at once, and each user at most per_user of them.
+    Waiting requests are served in start-time fair queuing order: every request
+    advances its user's virtual clock by characters / weight, so someone who just
+    sent a lot lines up behind users who did not. Short requests (up to
+    short_characters) go ahead of long ones. When characters_per_second is set, a
+    user may also send no more than that on average, in bursts of up to
+    burst_seconds worth.
+    """
+
+    def __init__(self, capacity=4, per_user=2, characters_per_second=0, burst_seconds=60, weights=None,
+                 short_characters=5000):
+        self.capacity = capacity
+        self.per_user = per_user
+        self.characters_per_second = characters_per_second
+        self.burst_seconds = burst_seconds
+        self.weights = weights or {}
+        self.short_characters = short_characters
+        self._condition = threading.Condition()
+        self._waiting = []
+        # owner -> requests running
+        self._running = {}
+        # owner -> virtual finish tag of the user's latest request
+        self._finish_tags = {}
+        self._virtual_time = 0.0
+        # owner -> when the characters the user has sent so far are paid off
+        self._rate_clocks = {}
+        self._sequence = itertools.count()
+        self._changes = 0
+        # Moving average of how long an admitted request runs, for wait estimates
+        self._service_seconds = 1.0
+
+    def weight(self, owner):
+        return self.weights.get(owner.lower(), 1.0)
+
+    def schedule(self, owner, characters):
+        """Charge characters to owner's rate limit and return the time (epoch seconds) they may start."""
+        now = time.time()
+        if not self.characters_per_second:
+            return now
+        rate = self.characters_per_second * self.weight(owner)
+        with self._condition:
+            # Users idle for a whole burst have their full allowance back
+            self._rate_clocks = {user: clock for user, clock in self._rate_clocks.items() if clock > now - self.burst_seconds}
+            clock = max(self._rate_clocks.get(owner, now), now - self.burst_seconds) + characters / rate
+            self._rate_clocks[owner] = clock
+        return max(now, clock - self.burst_seconds)
+
+    @contextmanager
+    def admit(self, owner, characters, on_wait=None):
+        """Run the block once it is owner's fair turn, and yield the seconds waited.
+
+        on_wait(position, seconds) is called about twice a second while the request
+        waits, with its place in line (1 is next) and the estimated seconds to go.
+        """
+        not_before = self.schedule(owner, characters)
+        with self._condition:
+            start_tag = max(self._virtual_time, self._finish_tags.get(owner, 0.0))
+            self._finish_tags[owner] = start_tag + max(characters, 1) / self.weight(owner)
+            ticket = Ticket(owner, characters <= self.short_characters, start_tag, not_before, next(self._sequence))
+            self._waiting.append(ticket)
+            self._changes += 1
+
+        requested = time.time()
+        try:
+            self._wait(ticket, on_wait)
+        except BaseException:
+            with self._condition:
+                self._waiting.remove(ticket)
+                self._changes += 1
+                self._condition.notify_all()
+            raise
+        started = time.time()
+        waited = started - requested
+        metrics.ADMISSION_WAIT.observe(waited, kind="short" if ticket.short else "long")
+        try:
+            yield waited
+        finally:
+            self._release(ticket, time.time() - started)
+
+    def _eligible(self, ticket, now):
+        return now >= ticket.not_before and self._running.get(ticket.owner, 0) < self.per_user
+
+    def _try_start(self, ticket):
+        now = time.time()
+        if sum(self._running.values()) >= self.capacity or not self._eligible(ticket, now):
+            return False
+        if any(other.key < ticket.key and self._eligible(other, now) for other in self._waiting):
+            return False
+        self._waiting.remove(ticket)
+        self._running[ticket.owner] = self._running.get(ticket.owner, 0) + 1
+        self._virtual_time = max(self._virtual_time, ticket.start_tag)
+        self._changes += 1
+        return True
+
+    def _estimate(self, ticket):
+        position = 1 + sum(1 for other in self._waiting if other.key < ticket.key)
+        seconds = math.ceil(position / self.capacity) * self._service_seconds
+        return position, max(seconds, ticket.not_before - time.time())
+
+    def _wait(self, ticket, on_wait):
+        while True:
+            with self._condition:
+                if self._try_start(ticket):
+                    return
+                seen = self._changes
+                position, seconds = self._estimate(ticket)
+            # Called without the lock, the callback may update a page
+            if on_wait:
+                on_wait(position, seconds)
+            with self._condition:
+                if self._changes == seen:
+                    self._condition.wait(0.5)
+
+    def _release(self, ticket, seconds):
+        with self._condition:
+            self._running[ticket.owner] -= 1
+            if not self._running[ticket.owner]:
+                del self._running[ticket.owner]
+            if not self._waiting and not self._running:
+                # Nobody is competing, so past usage no longer needs balancing
+                self._finish_tags.clear()
+            self._service_seconds = 0.8 * self._service_seconds + 0.2 * seconds
+            self._changes += 1
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {"running": sum(self._running.values()), "waiting": len(self._waiting)}
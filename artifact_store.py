@@ -0,0 +1,158 @@
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class ArtifactStore:
+    """Per-user store of finished translations, so results can be downloaded again.
+
+    Each artifact is keyed by an ID (the job ID for background jobs) and belongs to
+    the user who asked for it. Artifacts expire ttl_seconds after they were created,
+    and the least recently downloaded ones are evicted once the store grows past
+    max_bytes. Files that are also in the document cache are hard-linked, so keeping
+    both costs no extra disk space.
+    """
+
+    def __init__(self, store_dir, max_bytes=1024 ** 3, ttl_seconds=72 * 3600):
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+        if not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+        self._conn = sqlite3.connect(os.path.join(store_dir, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS artifacts (
+                artifact_id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                target_lang TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_artifacts_owner ON artifacts (owner, created_at)")
+        self._conn.commit()
+
+    def _path(self, filename):
+        return os.path.join(self.store_dir, filename)
+
+    def _row(self, row):
+        artifact_id, owner, file_name, target_lang, filename, size, created_at = row
+        return {
+            "artifact_id": artifact_id, "owner": owner, "file_name": file_name, "target_lang": target_lang,
+            "path": self._path(filename), "size": size, "created_at": created_at,
+        }
+
+    def put(self, owner, file_name, target_lang, source_path, artifact_id=None, move=False):
+        """Store a translated file for owner and return the artifact's path.
+
+        The file is moved in when move is True (the caller gives it up), otherwise it
+        is hard-linked, or copied if linking is not possible.
+        """
+        artifact_id = artifact_id or uuid.uuid4().hex
+        filename = f"{artifact_id}_{target_lang}_{file_name}"
+        path = self._path(filename)
+        size = os.path.getsize(source_path)
+
+        with self._lock:
+            if move:
+                shutil.move(source_path, path)
+            else:
+                try:
+                    os.link(source_path, path)
+                except OSError:
+                    shutil.copyfile(source_path, path)
+            now = time.time()
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO artifacts (artifact_id, owner, file_name, target_lang, filename, size, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (artifact_id, owner, file_name, target_lang, filename, size, now, now),
+            )
+            self._evict(keep=artifact_id)
+            self._conn.commit()
+        return path
+
+    def get(self, artifact_id, owner):
+        """Return the artifact if it belongs to owner and is still on disk, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT artifact_id, owner, file_name, target_lang, filename, size, created_at
+                FROM artifacts WHERE artifact_id = ? AND owner = ? AND created_at >= ?
+                """,
+                (artifact_id, owner, time.time() - self.ttl_seconds),
+            ).fetchone()
+            if row is None or not os.path.exists(self._path(row[4])):
+                return None
+            return self._row(row)
+
+    def touch(self, artifact_id):
+        """Record that the artifact was downloaded, so eviction keeps it longer."""
+        with self._lock:
+            self._conn.execute("UPDATE artifacts SET accessed_at = ? WHERE artifact_id = ?", (time.time(), artifact_id))
+            self._conn.commit()
+
+    def list_recent(self, owner, limit=10):
+        """Return the owner's unexpired artifacts, newest first."""
+        with self._lock:
+            self._evict()
+            self._conn.commit()
+            rows = self._conn.execute(
+                """
+                SELECT artifact_id, owner, file_name, target_lang, filename, size, created_at
+                FROM artifacts WHERE owner = ? ORDER BY created_at DESC LIMIT ?
+                """,
+                (owner, limit),
+            ).fetchall()
+        return [self._row(row) for row in rows if os.path.exists(self._path(row[4]))]
+
+    def _remove(self, artifact_id, filename):
+        try:
+            os.remove(self._path(filename))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"Error evicting artifact {filename}: {str(e)}")
+            return False
+        self._conn.execute("DELETE FROM artifacts WHERE artifact_id = ?", (artifact_id,))
+        return True
+
+    def _evict(self, keep=None):
+        expired = self._conn.execute(
+            "SELECT artifact_id, filename FROM artifacts WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+        ).fetchall()
+        for artifact_id, filename in expired:
+            self._remove(artifact_id, filename)
+
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT artifact_id, filename, size FROM artifacts ORDER BY accessed_at ASC"
+        ).fetchall()
+        for artifact_id, filename, size in rows:
+            if total <= self.max_bytes:
+                break
+            # Never evict the artifact that is being added
+            if artifact_id != keep and self._remove(artifact_id, filename):
+                total -= size
+                logging.info(f"Artifact store evicted {filename}")
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts"
+            ).fetchone()
+            return {"entries": entries, "bytes": total}
@@ -0,0 +1,141 @@
+"""Translate a directory of documents without the web app.
+
+Example:
+    python batch_translate.py ./archive ./translated --target ES --target PT-BR --workers 8
+
+Every supported file (pdf/docx/pptx/txt) under the input directory is translated into
+<output_dir>/<TARGET>/<relative path>. Progress is appended to a manifest
+(<output_dir>/manifest.jsonl by default) so an interrupted run can simply be started
+again: files whose content and target are already recorded as done are skipped.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+
+class Manifest:
+    """Append-only JSON-lines record of finished and failed files."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A run killed mid-write can leave a partial last line
+                        continue
+                    self.entries[(entry["source"], entry["target_lang"])] = entry
+
+    def is_done(self, source, target_lang, file_hash, output_path):
+        entry = self.entries.get((source, target_lang))
+        return (
+            entry is not None
+            and entry["status"] == "done"
+            and entry["sha256"] == file_hash
+            and os.path.exists(output_path)
+        )
+
+    def record(self, **entry):
+        entry["finished_at"] = time.time()
+        with self._lock:
+            self.entries[(entry["source"], entry["target_lang"])] = entry
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def find_documents(input_dir, extensions):
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in extensions:
+                yield os.path.relpath(os.path.join(root, name), input_dir)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Translate every supported document in a directory with DeepL.")
+    parser.add_argument("input_dir", help="Directory to scan for pdf/docx/pptx/txt files")
+    parser.add_argument("output_dir", help="Directory to write translations into")
+    parser.add_argument("--target", "-t", action="append", required=True, help="Target language code, e.g. ES or PT-BR (repeatable)")
+    parser.add_argument("--workers", "-w", type=int, default=4, help="Number of documents translated at the same time (default: 4)")
+    parser.add_argument("--manifest", help="Manifest path (default: <output_dir>/manifest.jsonl)")
+    parser.add_argument("--optimize-images", action="store_true", help="Compress images in DOCX/PPTX files before uploading")
+    parser.add_argument("--env-file", default="configs/app.env", help="Environment file with DEEPL_API_KEY (default: configs/app.env)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    # The SDK logs every request at INFO, which drowns out per-file progress
+    logging.getLogger("deepl").setLevel(logging.WARNING)
+    load_dotenv(args.env_file)
+
+    # Imported after the environment is loaded so the engine sees the configuration
+    import engine
+    engine.configure(doc_workers=args.workers, deepl_pool_size=max(args.workers * 2, engine.get_settings().deepl_pool_size))
+    engine.start_metrics()
+
+    targets = [target.upper() for target in args.target]
+    manifest = Manifest(args.manifest or os.path.join(args.output_dir, "manifest.jsonl"))
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    tasks = []
+    skipped = 0
+    for source in find_documents(args.input_dir, engine.SUPPORTED_EXTENSIONS):
+        input_path = os.path.join(args.input_dir, source)
+        file_hash = engine.hash_file(input_path)
+        for target in targets:
+            output_path = os.path.join(args.output_dir, target, source)
+            if manifest.is_done(source, target, file_hash, output_path):
+                skipped += 1
+                continue
+            tasks.append((source, input_path, file_hash, target, output_path))
+    logging.info(f"{len(tasks)} translations to run, {skipped} already done")
+
+    def run(task):
+        source, input_path, file_hash, target, output_path = task
+        start = time.time()
+        from_cache = engine.translate_path(input_path, output_path, target, optimize_images=args.optimize_images)
+        return from_cache, time.time() - start
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(run, task): task for task in tasks}
+        for index, future in enumerate(as_completed(futures), start=1):
+            source, _, file_hash, target, output_path = futures[future]
+            try:
+                from_cache, seconds = future.result()
+                manifest.record(source=source, target_lang=target, sha256=file_hash, status="done",
+                                output=output_path, from_cache=from_cache, seconds=round(seconds, 2))
+                logging.info(f"[{index}/{len(tasks)}] {source} -> {target} done in {seconds:.1f}s" + (" (cache)" if from_cache else ""))
+            except Exception as e:
+                failed += 1
+                manifest.record(source=source, target_lang=target, sha256=file_hash, status="error", error=str(e))
+                logging.error(f"[{index}/{len(tasks)}] {source} -> {target} failed: {str(e)}")
+
+    logging.info(f"Finished: {len(tasks) - failed} translated, {failed} failed, {skipped} skipped")
+    settings = engine.get_settings()
+    if settings.metrics_dump_path:
+        # The periodic dump may not have fired yet on a short run
+        engine.metrics.write_dump(settings.metrics_dump_path)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
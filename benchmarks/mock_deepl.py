@@ -0,0 +1,172 @@
+"""Local stand-in for the DeepL API (and the Microsoft Graph profile endpoint) used by the benchmarks.
+
+Example:
+    python benchmarks/mock_deepl.py --port 18555 --latency 0.05 --document-seconds 1 --failure-rate 0.02
+
+Translations are fake: text is returned prefixed with "[<TARGET>]" and documents are
+returned as "[<TARGET>]" followed by the uploaded bytes. Point the app or the engine
+at it with DEEPL_SERVER_URL=http://127.0.0.1:<port> and
+GRAPH_ME_URL=http://127.0.0.1:<port>/v1.0/me.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockState:
+    def __init__(self, latency, document_seconds, failure_rate, failure_status, character_limit):
+        self.latency = latency
+        self.document_seconds = document_seconds
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.character_limit = character_limit
+        self.character_count = 0
+        self.documents = {}
+        self.requests = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, body, content_type="application/json", status=200):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def read_form(self, body):
+        content_type = self.headers.get("Content-Type", "")
+        if "multipart/form-data" in content_type:
+            message = BytesParser().parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+            fields = {}
+            for part in message.get_payload():
+                fields[part.get_param("name", header="content-disposition")] = part.get_payload(decode=True)
+            return fields
+        if "json" in content_type:
+            return json.loads(body or b"{}")
+        return {name: values if name == "text" else values[0] for name, values in urllib.parse.parse_qs(body.decode("utf-8")).items()}
+
+    def injected_failure(self):
+        with self.state.lock:
+            self.state.requests += 1
+            failed = random.random() < self.state.failure_rate
+            if failed:
+                self.state.failures += 1
+        if failed:
+            self.reply({"message": "Injected failure"}, status=self.state.failure_status)
+        return failed
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def handle_request(self):
+        body = self.read_body()
+        path = urllib.parse.urlparse(self.path).path
+        state = self.state
+
+        if path == "/v1.0/me":
+            return self.reply({"displayName": "Benchmark User", "userPrincipalName": "bench@localhost"})
+        if path == "/v2/usage":
+            return self.reply({"character_count": state.character_count, "character_limit": state.character_limit})
+        if path == "/stats":
+            return self.reply({"requests": state.requests, "failures": state.failures, "documents": len(state.documents)})
+        if self.injected_failure():
+            return
+
+        if path == "/v2/translate":
+            form = self.read_form(body)
+            texts = form["text"] if isinstance(form["text"], list) else [form["text"]]
+            target_lang = form["target_lang"]
+            time.sleep(state.latency)
+            with state.lock:
+                state.character_count += sum(len(text) for text in texts)
+            return self.reply({"translations": [
+                {"detected_source_language": "EN", "text": f"[{target_lang}]{text}"} for text in texts
+            ]})
+
+        if path == "/v2/document":
+            form = self.read_form(body)
+            document_id = uuid.uuid4().hex
+            target_lang = form["target_lang"].decode("utf-8")
+            time.sleep(state.latency)
+            with state.lock:
+                state.documents[document_id] = (form["file"], target_lang, time.time())
+            return self.reply({"document_id": document_id, "document_key": "key" + document_id})
+
+        parts = path.strip("/").split("/")
+        if len(parts) >= 3 and parts[1] == "document":
+            with state.lock:
+                document = state.documents.get(parts[2])
+            if document is None:
+                return self.reply({"message": "Document not found"}, status=404)
+            data, target_lang, uploaded_at = document
+            done = time.time() - uploaded_at >= state.document_seconds
+            if len(parts) == 4 and parts[3] == "result":
+                if not done:
+                    return self.reply({"message": "Document not ready"}, status=503)
+                with state.lock:
+                    state.documents.pop(parts[2], None)
+                    state.character_count += len(data)
+                return self.reply(f"[{target_lang}]".encode("utf-8") + data, "application/octet-stream")
+            remaining = max(0, int(state.document_seconds - (time.time() - uploaded_at)))
+            return self.reply({
+                "document_id": parts[2],
+                "status": "done" if done else "translating",
+                "seconds_remaining": remaining,
+                "billed_characters": len(data) if done else None,
+            })
+
+        self.reply({"message": "Not found"}, status=404)
+
+
+def make_server(port, latency=0.0, document_seconds=0.0, failure_rate=0.0, failure_status=503, character_limit=10 ** 12):
+    handler = type("Handler", (MockHandler,), {
+        "state": MockState(latency, document_seconds, failure_rate, failure_status, character_limit)
+    })
+    return ThreadingHTTPServer(("127.0.0.1", port), handler)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a fake DeepL API for benchmarks.")
+    parser.add_argument("--port", type=int, default=18555)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every translate/upload request")
+    parser.add_argument("--document-seconds", type=float, default=0.0, help="Seconds a document stays 'translating' after upload")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of DeepL requests answered with --failure-status")
+    parser.add_argument("--failure-status", type=int, default=503, help="Status code for injected failures, e.g. 429 or 503")
+    parser.add_argument("--character-limit", type=int, default=10 ** 12, help="Character limit reported by /v2/usage")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = make_server(args.port, args.latency, args.document_seconds, args.failure_rate, args.failure_status, args.character_limit)
+    print(f"Mock DeepL listening on http://127.0.0.1:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
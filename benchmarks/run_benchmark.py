@@ -0,0 +1,388 @@
+"""Load-test the translation engine against the local DeepL stand-in.
+
+Example:
+    python benchmarks/run_benchmark.py --sessions 8 --iterations 5 --sizes 10KB,1MB,4MB \\
+        --latency 0.05 --document-seconds 0.5 --failure-rate 0.02 --output results.json
+
+Each simulated session goes through the same code paths as the app. It looks up its
+Graph profile through the engine's profile cache (the MSAL token is stubbed and Graph is
+the mock server), translates a block of text once admission control lets it in, then
+for every file size saves an upload, submits it to the document job queue, follows the
+job until a job worker has finished it and reads the result back. Every request uses
+fresh content, with no paragraph repeated within or across scenarios, so the caches and
+the segment memory do not hide DeepL, unless --warm-cache is set.
+
+The report shows throughput, p50/p95/p99 latency per scenario, peak RSS and the peak
+size of the temp/output directories. Pass --baseline with the JSON of an earlier run to
+see how the numbers moved.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+FAKE_TOKEN = "benchmark-token"
+# The app's progress fragment polls every 2 s; polling faster keeps that out of the latency
+JOB_POLL_INTERVAL = 0.05
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    for suffix, factor in (("KB", 1024), ("MB", 1024 ** 2), ("GB", 1024 ** 3), ("B", 1)):
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)]) * factor)
+    return int(text)
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile, good enough for a few hundred samples
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def make_text(size, seed):
+    # Every paragraph is different, so neither batching nor the segment memory can
+    # collapse the text into a single DeepL request for one repeated paragraph
+    paragraphs = []
+    length = 0
+    index = 0
+    while length < size:
+        paragraph = " ".join(
+            f"Benchmark sentence {sentence} of paragraph {index} ({seed}) about translation throughput and latency."
+            for sentence in range(8)
+        ) + "\n\n"
+        paragraphs.append(paragraph)
+        length += len(paragraph)
+        index += 1
+    return "".join(paragraphs)[:size]
+
+
+def make_document(path, file_format, size, seed):
+    if file_format == "txt":
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(make_text(size, seed))
+        return
+    # A minimal Office-like package; the mock server never looks inside it
+    body = make_text(size, seed)
+    part = "word/document.xml" if file_format == "docx" else "ppt/slides/slide1.xml"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as package:
+        package.writestr("[Content_Types].xml", "<Types/>")
+        package.writestr(part, f"<document><body>{body}</body></document>")
+
+
+class Sampler:
+    """Samples the process RSS and the size of the work directories in the background."""
+
+    def __init__(self, directories, interval=0.05):
+        self.directories = directories
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="benchmark-sampler", daemon=True)
+
+    def _rss(self):
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def _disk(self):
+        total = 0
+        for directory in self.directories:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    try:
+                        total += os.path.getsize(os.path.join(root, name))
+                    except OSError:
+                        # Files come and go while we walk
+                        pass
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, self._rss())
+            self.peak_disk = max(self.peak_disk, self._disk())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        # ru_maxrss is in kilobytes on Linux and catches peaks between samples
+        self.peak_rss = max(self.peak_rss, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.bytes = {}
+        self._lock = threading.Lock()
+
+    def time(self, scenario, fn, size=0):
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            with self._lock:
+                self.errors.setdefault(scenario, []).append(str(e))
+            return
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.samples.setdefault(scenario, []).append(elapsed)
+            self.bytes[scenario] = self.bytes.get(scenario, 0) + size
+
+
+def start_mock(args):
+    command = [
+        sys.executable, os.path.join(ROOT, "benchmarks", "mock_deepl.py"),
+        "--port", str(args.port), "--latency", str(args.latency),
+        "--document-seconds", str(args.document_seconds),
+        "--failure-rate", str(args.failure_rate), "--failure-status", str(args.failure_status),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    # Wait for the "listening" line so the first request does not race the bind
+    process.stdout.readline()
+    return process
+
+
+def run_session(engine, recorder, args, session, work_dir):
+    owner = f"user{session}@benchmark"
+    # Each session signs in with its own token, so the first lookup goes to Graph and
+    # later ones come from the profile cache, as reruns of a signed-in session do
+    token = f"{FAKE_TOKEN}-{session}"
+    for iteration in range(args.iterations):
+        seed = "warm" if args.warm_cache else f"{session}-{iteration}-{uuid.uuid4().hex}"
+
+        def lookup_profile():
+            profile, status_code = engine.lookup_graph_profile(token)
+            if profile is None:
+                raise RuntimeError(f"Graph lookup failed with status {status_code}")
+
+        recorder.time("graph_lookup", lookup_profile)
+
+        if "text" in args.modes:
+            text = make_text(args.text_size, seed)
+
+            def translate_text():
+                # Text requests wait for the owner's fair turn, as in the app
+                with engine.get_admission().admit(owner, len(text)):
+                    engine.translate_text_cached(text, args.target)
+
+            recorder.time("text", translate_text, size=len(text))
+
+        if "document" in args.modes:
+            for file_format in args.formats:
+                for size in args.sizes:
+                    source = os.path.join(work_dir, f"source_{session}_{seed}_{size}.{file_format}")
+                    # Seeded per scenario: a small TXT must not be a revision of a larger one
+                    make_document(source, file_format, size, f"{seed}-{file_format}-{size}")
+                    actual_size = os.path.getsize(source)
+                    scenario = f"document_{file_format}_{format_size(size)}"
+
+                    def translate_document():
+                        # Same steps as the app: chunked save, cache check, a job on the
+                        # queue followed until it is done, and the result read back
+                        file_name = os.path.basename(source)
+                        input_path = engine.temp_path(file_name)
+                        with open(source, "rb") as upload, open(input_path, "wb") as f:
+                            while True:
+                                chunk = upload.read(UPLOAD_CHUNK_SIZE)
+                                if not chunk:
+                                    break
+                                f.write(chunk)
+                        file_hash = engine.cache_hash_for(engine.hash_file(input_path), False)
+                        path = engine.get_document_cache().get(file_hash, args.target)
+                        if path:
+                            os.remove(input_path)
+                        else:
+                            path = wait_for_job(engine, owner, file_name, file_hash, input_path, args.target)
+                        with open(path, "rb") as f:
+                            f.read()
+
+                    recorder.time(scenario, translate_document, size=actual_size)
+                    os.remove(source)
+
+
+def wait_for_job(engine, owner, file_name, file_hash, input_path, target):
+    try:
+        engine.check_document_quota(input_path)
+        characters = engine.estimate_document_characters(input_path)
+    except BaseException:
+        os.remove(input_path)
+        raise
+    job_manager = engine.get_job_manager()
+    job_id = job_manager.submit(
+        owner, file_name, file_hash, target, input_path,
+        not_before=engine.get_admission().schedule(owner, characters)
+    )
+    while True:
+        job = job_manager.get(job_id)
+        if job["state"] == "done":
+            return job["output_path"]
+        if job["state"] == "error":
+            raise RuntimeError(job["error"])
+        time.sleep(JOB_POLL_INTERVAL)
+
+
+def summarize(recorder, wall_seconds, sampler):
+    scenarios = {}
+    for scenario, values in sorted(recorder.samples.items()):
+        scenarios[scenario] = {
+            "count": len(values),
+            "errors": len(recorder.errors.get(scenario, [])),
+            "throughput_per_s": len(values) / wall_seconds,
+            "mb_per_s": recorder.bytes.get(scenario, 0) / (1024 * 1024) / wall_seconds,
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+            "max": max(values),
+        }
+    for scenario, errors in recorder.errors.items():
+        if scenario not in scenarios:
+            scenarios[scenario] = {"count": 0, "errors": len(errors)}
+    return {
+        "wall_seconds": wall_seconds,
+        "peak_rss_bytes": sampler.peak_rss,
+        "peak_temp_disk_bytes": sampler.peak_disk,
+        "scenarios": scenarios,
+    }
+
+
+def change(current, previous):
+    if not previous:
+        return ""
+    return f" ({(current - previous) / previous * 100:+.0f}%)"
+
+
+def print_report(result, baseline=None):
+    base = (baseline or {}).get("scenarios", {})
+    print(f"\nWall time {result['wall_seconds']:.1f}s, peak RSS {format_size(result['peak_rss_bytes'])}"
+          f"{change(result['peak_rss_bytes'], (baseline or {}).get('peak_rss_bytes'))}, "
+          f"peak temp disk {format_size(result['peak_temp_disk_bytes'])}")
+    print(f"{'scenario':<26}{'n':>5}{'err':>5}{'ops/s':>9}{'MB/s':>8}{'p50 s':>16}{'p95 s':>16}{'p99 s':>16}")
+    for scenario, stats in result["scenarios"].items():
+        if not stats["count"]:
+            print(f"{scenario:<26}{0:>5}{stats['errors']:>5}")
+            continue
+        old = base.get(scenario, {})
+        cells = [f"{stats[name]:.3f}{change(stats[name], old.get(name))}" for name in ("p50", "p95", "p99")]
+        print(f"{scenario:<26}{stats['count']:>5}{stats['errors']:>5}{stats['throughput_per_s']:>9.2f}"
+              f"{stats['mb_per_s']:>8.2f}{cells[0]:>16}{cells[1]:>16}{cells[2]:>16}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the translation engine against a local DeepL stand-in.")
+    parser.add_argument("--sessions", type=int, default=4, help="Concurrent simulated user sessions")
+    parser.add_argument("--iterations", type=int, default=3, help="Requests per session and scenario")
+    parser.add_argument("--modes", default="text,document", help="Comma-separated: text, document")
+    parser.add_argument("--sizes", default="10KB,1MB", help="Comma-separated document sizes, e.g. 10KB,1MB,25MB")
+    parser.add_argument("--formats", default="txt", help="Comma-separated document formats: txt, docx, pptx")
+    parser.add_argument("--text-size", default="4KB", help="Size of the pasted text per request")
+    parser.add_argument("--target", default="DE", help="Target language")
+    parser.add_argument("--warm-cache", action="store_true", help="Reuse the same content so caches are exercised")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock latency per translate/upload request (seconds)")
+    parser.add_argument("--document-seconds", type=float, default=0.5, help="Mock time to translate a document (seconds)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of mock DeepL requests that fail")
+    parser.add_argument("--failure-status", type=int, default=503, help="Status code of injected failures (429 or 5xx)")
+    parser.add_argument("--port", type=int, default=18555, help="Port for the mock server")
+    parser.add_argument("--server-url", help="Use an already running mock server instead of starting one")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+    args.modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    args.formats = [file_format.strip().lower() for file_format in args.formats.split(",") if file_format.strip()]
+    args.sizes = [parse_size(size) for size in args.sizes.split(",") if size.strip()]
+    args.text_size = parse_size(args.text_size)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mock = None
+    if not args.server_url:
+        args.server_url = f"http://127.0.0.1:{args.port}"
+        mock = start_mock(args)
+
+    work_dir = tempfile.mkdtemp(prefix="translator-benchmark-")
+    os.environ.update({
+        "DEEPL_API_KEY": "benchmark-key:fx", "DEEPL_SERVER_URL": args.server_url,
+        "GRAPH_ME_URL": f"{args.server_url}/v1.0/me",
+    })
+    import engine
+    engine.configure(
+        cache_dir=os.path.join(work_dir, "cache"),
+        temp_dir=os.path.join(work_dir, "temp"),
+        output_dir=os.path.join(work_dir, "output"),
+    )
+    engine.ensure_work_dirs()
+    settings = engine.get_settings()
+
+    recorder = Recorder()
+    try:
+        with Sampler([settings.temp_dir, settings.output_dir]) as sampler:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.sessions, thread_name_prefix="session") as executor:
+                sessions = [executor.submit(run_session, engine, recorder, args, session, work_dir) for session in range(args.sessions)]
+                for session in sessions:
+                    session.result()
+            wall_seconds = time.perf_counter() - start
+    finally:
+        if "document" in args.modes:
+            engine.get_job_manager().stop()
+        if mock:
+            mock.terminate()
+            mock.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    result = summarize(recorder, wall_seconds, sampler)
+    result["config"] = {
+        name: getattr(args, name) for name in (
+            "sessions", "iterations", "modes", "sizes", "formats", "text_size", "warm_cache",
+            "latency", "document_seconds", "failure_rate", "failure_status",
+        )
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    for scenario, errors in recorder.errors.items():
+        print(f"{scenario}: {len(errors)} errors, first: {errors[0]}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import deepl
+
+
+class DeepLClientPool:
+    """Process-wide pool of DeepL clients.
+
+    Each client keeps its own HTTP session, so connections stay alive between calls
+    instead of being re-established for every document. A client that hits a
+    connection error is closed and replaced, and clients that sat idle are
+    health-checked before being handed out again. Bulk (non-interactive) calls may
+    hold at most size - reserved clients at once, so interactive calls always find one.
+
+    The SDK's own retries are turned off: 429 and 5xx responses are retried by the
+    DeepLScheduler, which knows about the rate limits, and a call that fails to
+    connect is retried here up to max_retries times on a fresh client.
+    """
+
+    def __init__(self, auth_key, size=4, server_url=None, timeout=None, max_retries=1, health_check_interval=300,
+                 reserved=0):
+        if not auth_key:
+            raise ValueError("DeepL API key is missing")
+        self.auth_key = auth_key
+        self.size = size
+        self.server_url = server_url
+        self.health_check_interval = health_check_interval
+        self.max_retries = max_retries
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._bulk_slots = threading.BoundedSemaphore(max(1, size - reserved))
+        self.recycled = 0
+
+        # The SDK keeps its network settings at module level, so they apply to every client
+        if timeout is not None:
+            deepl.http_client.min_connection_timeout = timeout
+        # Otherwise every scheduler attempt would be retried again inside the SDK
+        deepl.http_client.max_network_retries = 0
+
+    def _new_client(self):
+        client = deepl.Translator(auth_key=self.auth_key, server_url=self.server_url)
+        return client, time.time()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._new_client()
+        # Every client is busy, wait for one to come back
+        return self._idle.get()
+
+    def _healthy(self, client):
+        try:
+            client.get_usage()
+            return True
+        except deepl.ConnectionException:
+            return False
+
+    def _recycle(self, client):
+        self.recycled += 1
+        try:
+            client.close()
+        except Exception as e:
+            logging.error(f"Error closing DeepL client: {str(e)}")
+        return self._new_client()
+
+    @contextmanager
+    def client(self, interactive=False):
+        if not interactive:
+            self._bulk_slots.acquire()
+        try:
+            with self._client() as client:
+                yield client
+        finally:
+            if not interactive:
+                self._bulk_slots.release()
+
+    @contextmanager
+    def _client(self):
+        client, last_used = self._acquire()
+        if time.time() - last_used > self.health_check_interval and not self._healthy(client):
+            logging.info("Idle DeepL client failed its health check, recycling it")
+            client, last_used = self._recycle(client)
+        try:
+            yield client
+        except deepl.ConnectionException:
+            client, last_used = self._recycle(client)
+            raise
+        finally:
+            self._idle.put((client, time.time()))
+
+    def call(self, fn, interactive=False):
+        """Run fn(client) on a pooled client, retrying connection errors on a fresh connection."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.client(interactive) as client:
+                    return fn(client)
+            except deepl.ConnectionException:
+                if attempt == self.max_retries:
+                    raise
+                logging.warning("DeepL connection failed, retrying with a fresh client")
+                time.sleep(min(5, 0.5 * 2 ** attempt))
+
+    def stats(self):
+        return {"size": self.size, "created": self._created, "idle": self._idle.qsize(), "recycled": self.recycled}
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_stream(stream):
+    # Hash a file-like object in chunks and rewind it so it can still be saved
+    digest = hashlib.sha256()
+    stream.seek(0)
+    while True:
+        chunk = stream.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+class DocumentCache:
+    """On-disk cache of translated documents keyed on source SHA-256 and target language."""
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                sha256 TEXT NOT NULL,
+                target_lang TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (sha256, target_lang)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def _path(self, filename):
+        return os.path.join(self.cache_dir, filename)
+
+    def get(self, sha256, target_lang):
+        """Return the path of the cached translation, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT filename FROM documents WHERE sha256 = ? AND target_lang = ?",
+                (sha256, target_lang),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            path = self._path(row[0])
+            if not os.path.exists(path):
+                # The file was removed behind our back, forget about it
+                self._conn.execute(
+                    "DELETE FROM documents WHERE sha256 = ? AND target_lang = ?", (sha256, target_lang)
+                )
+                self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE documents SET accessed_at = ? WHERE sha256 = ? AND target_lang = ?",
+                (time.time(), sha256, target_lang),
+            )
+            self._conn.commit()
+            self.hits += 1
+            return path
+
+    def put(self, sha256, target_lang, output_path):
+        """Move a translated file into the cache and return its cached path."""
+        extension = os.path.splitext(output_path)[1]
+        filename = f"{sha256}_{target_lang}{extension}"
+        cached_path = self._path(filename)
+        size = os.path.getsize(output_path)
+        if size > self.max_bytes:
+            logging.info(f"Not caching {output_path}: larger than the cache quota")
+            return None
+
+        with self._lock:
+            shutil.move(output_path, cached_path)
+            now = time.time()
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO documents (sha256, target_lang, filename, size, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (sha256, target_lang, filename, size, now, now),
+            )
+            self._evict()
+            self._conn.commit()
+        return cached_path
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT sha256, target_lang, filename, size FROM documents ORDER BY accessed_at ASC"
+        ).fetchall()
+        for sha256, target_lang, filename, size in rows:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(filename))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"Error evicting cached document {filename}: {str(e)}")
+                continue
+            self._conn.execute(
+                "DELETE FROM documents WHERE sha256 = ? AND target_lang = ?", (sha256, target_lang)
+            )
+            total -= size
+            logging.info(f"Document cache evicted {filename}")
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM documents"
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "bytes": total,
+            }
@@ -0,0 +1,511 @@
+import logging
+import math
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import deepl
+
+from rate_limiter import RETRYABLE_STATUS_CODES
+from single_flight import SingleFlight
+
+# "pending" jobs wait in the queue for a worker; the others are being worked on
+ACTIVE_STATES = ("pending", "uploading", "queued", "translating", "downloading")
+TERMINAL_STATES = ("done", "error")
+
+JOB_COLUMNS = (
+    "job_id", "owner", "file_name", "file_hash", "target_lang", "state",
+    "input_path", "output_path", "document_id", "document_key",
+    "seconds_remaining", "billed_characters", "error", "created_at", "updated_at",
+    "file_size", "translating_since", "finished_at", "source_lang",
+    "attempts", "lease_owner", "lease_expires", "next_attempt_at", "started_at", "keep_output",
+)
+# Columns added after the first release, created on existing databases at startup
+ADDED_COLUMNS = (
+    ("file_size", "INTEGER"), ("translating_since", "REAL"), ("finished_at", "REAL"), ("source_lang", "TEXT"),
+    ("attempts", "INTEGER"), ("lease_owner", "TEXT"), ("lease_expires", "REAL"), ("next_attempt_at", "REAL"),
+    ("started_at", "REAL"), ("keep_output", "INTEGER"),
+)
+
+# Where the progress bar stands when each state begins; "translating" fills most of the rest
+PHASE_PROGRESS = {"pending": 0.0, "uploading": 0.05, "queued": 0.15, "translating": 0.25, "downloading": 0.9, "done": 1.0}
+PHASE_MESSAGES = {
+    "pending": "Waiting for a worker...",
+    "uploading": "Uploading to DeepL...",
+    "queued": "Waiting in DeepL queue...",
+    "translating": "Translating document...",
+    "downloading": "Downloading translation...",
+}
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    return f"{seconds // 60}m {seconds % 60:02d}s"
+
+
+def estimate_progress(state, translating_seconds=0.0, seconds_remaining=None):
+    """Return the progress bar fraction for a document, using DeepL's own time estimate."""
+    if state != "translating":
+        return PHASE_PROGRESS.get(state, 0.0)
+    if seconds_remaining is not None and translating_seconds + seconds_remaining > 0:
+        share = translating_seconds / (translating_seconds + seconds_remaining)
+    else:
+        # No estimate from DeepL yet, keep creeping forward so the bar never looks stuck
+        share = 1 - math.exp(-translating_seconds / 30)
+    return PHASE_PROGRESS["translating"] + (PHASE_PROGRESS["downloading"] - PHASE_PROGRESS["translating"]) * min(share, 1.0)
+
+
+def describe_progress(state, elapsed, seconds_remaining=None, queue_position=None):
+    """Describe a job's progress; for a pending job, seconds_remaining is the estimated wait for a worker."""
+    message = PHASE_MESSAGES.get(state, "Working...")
+    if state == "pending" and queue_position:
+        message += f" number {queue_position} in line"
+        if seconds_remaining:
+            message += f", about {format_duration(seconds_remaining)} to go"
+    elif state in ("queued", "translating") and seconds_remaining:
+        message += f" about {format_duration(seconds_remaining)} left"
+    return f"{message} ({format_duration(elapsed)} elapsed)"
+
+
+def describe_throughput(seconds, size_bytes=None, billed_characters=None):
+    parts = [f"Done in {format_duration(seconds)}"]
+    if seconds > 0 and size_bytes:
+        parts.append(f"{size_bytes / 1024 / seconds:,.0f} KB/s")
+    if seconds > 0 and billed_characters:
+        parts.append(f"{billed_characters / seconds:,.0f} characters/s")
+    return " · ".join(parts)
+
+
+class DocumentJobManager:
+    """A persistent queue of DeepL document translations and the workers that run them.
+
+    Jobs live in SQLite: submit() only records a job and its saved upload, and worker
+    threads (started here with max_workers, or by worker.py in separate processes)
+    lease them one at a time. A worker renews its lease while it runs a job; when a
+    worker dies, its lease runs out after lease_seconds and another worker resumes the
+    job from the DeepL document it had already uploaded. Connection errors and DeepL
+    overload put the job back in the queue with exponential backoff, up to
+    max_attempts. With max_workers=0 the process only enqueues and reads status.
+
+    Owners share the workers fairly: the next job goes to the owner running the
+    fewest jobs for their weight(owner), and no owner runs more than per_user jobs
+    at once, so one large batch cannot hold back everyone else's documents.
+
+    translate_document(input_path, output_path, target_lang, source_language, document=,
+    on_status=) does the translation. It calls on_status(state, **details) at every
+    step, and the job's row follows along, so the UI can poll a job across reruns and
+    page reloads. The DeepL handle it reports after uploading is stored with the job
+    and passed back as document when another attempt resumes the job.
+
+    on_complete(job, output_path) runs once per translation produced (e.g. to cache it)
+    and returns a path that other jobs may share; on_done(job, path, owned) runs for
+    every finished job, including those that shared another job's result, and returns
+    where the job's output ended up. owned is True when the job may move the file.
+    """
+
+    def __init__(self, db_path, output_dir, translate_document, on_complete=None, on_done=None, max_workers=4,
+                 poll_interval=2.0,
+                 lease_seconds=60, max_attempts=3, retry_delay=30, per_user=None, weight=None):
+        self.output_dir = output_dir
+        # Uploads wait here, next to the queue, so workers in other processes can read them
+        self.input_dir = os.path.join(os.path.dirname(db_path), "job_inputs")
+        self.translate_document = translate_document
+        self.on_complete = on_complete
+        self.on_done = on_done
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.per_user = per_user
+        self.weight = weight or (lambda owner: 1.0)
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        # Released once per submitted job so idle workers in this process start at once
+        self._wake = threading.Semaphore(0)
+        self._stopping = threading.Event()
+        self._workers = []
+        self._keeper = None
+        # Job ID -> worker ID, for the jobs this process holds a lease on
+        self._held = {}
+
+        for directory in [os.path.dirname(db_path), output_dir, self.input_dir]:
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+        # The app and any number of worker processes share this database
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                file_hash TEXT NOT NULL,
+                target_lang TEXT NOT NULL,
+                state TEXT NOT NULL,
+                input_path TEXT,
+                output_path TEXT,
+                document_id TEXT,
+                document_key TEXT,
+                seconds_remaining INTEGER,
+                billed_characters INTEGER,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in ADDED_COLUMNS:
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs (owner, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, created_at)")
+        self._conn.commit()
+        if max_workers:
+            self.start(max_workers)
+
+    def _select(self, where, params=(), suffix=""):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE {where} {suffix}", params
+            ).fetchall()
+        return [dict(zip(JOB_COLUMNS, row)) for row in rows]
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def _release(self, job_id, worker_id, **fields):
+        # Final update of a leased job; ignored if the lease ran out and another worker took the job
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            released = self._conn.execute(
+                f"UPDATE jobs SET {assignments}, lease_owner = NULL, lease_expires = NULL WHERE job_id = ? AND lease_owner = ?",
+                (*fields.values(), job_id, worker_id),
+            ).rowcount
+            self._conn.commit()
+        if not released:
+            logging.warning(f"Document job {job_id} was taken over by another worker, dropped this worker's result")
+        return bool(released)
+
+    def get(self, job_id):
+        jobs = self._select("job_id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def list_jobs(self, owner, limit=20):
+        # Jobs whose output is not kept (archive entries) are followed by whoever submitted them
+        return self._select(
+            "owner = ? AND COALESCE(keep_output, 1) = 1", (owner,), f"ORDER BY created_at DESC LIMIT {int(limit)}"
+        )
+
+    def find_active(self, owner, file_hash, target_lang, keep_output=True):
+        jobs = self._select(
+            f"owner = ? AND file_hash = ? AND target_lang = ? AND COALESCE(keep_output, 1) = ? "
+            f"AND state IN ({', '.join('?' * len(ACTIVE_STATES))})",
+            (owner, file_hash, target_lang, int(keep_output), *ACTIVE_STATES),
+        )
+        return jobs[0] if jobs else None
+
+    def queue_stats(self):
+        """Return the number of unfinished jobs in each state."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT state, COUNT(*) FROM jobs WHERE state IN ({', '.join('?' * len(ACTIVE_STATES))}) GROUP BY state",
+                ACTIVE_STATES,
+            ).fetchall()
+        return {state: dict(rows).get(state, 0) for state in ACTIVE_STATES}
+
+    def submit(self, owner, file_name, file_hash, target_lang, input_path, source_lang=None, not_before=None,
+               keep_output=True):
+        """Queue a saved upload for translation and return its job id.
+
+        The upload is moved into the queue's input directory. An identical job that is
+        still running for the same owner is reused instead. source_lang, when known,
+        is passed to DeepL instead of letting it detect the language; no worker takes
+        the job before not_before (epoch seconds), if given. keep_output is passed on
+        to on_done; jobs without it are left out of list_jobs.
+        """
+        existing = self.find_active(owner, file_hash, target_lang, keep_output)
+        if existing:
+            if os.path.exists(input_path):
+                os.remove(input_path)
+            return existing["job_id"]
+
+        job_id = uuid.uuid4().hex
+        queued_path = os.path.join(self.input_dir, os.path.basename(input_path))
+        shutil.move(input_path, queued_path)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO jobs (job_id, owner, file_name, file_hash, target_lang, source_lang, state, input_path, file_size,
+                                  attempts, next_attempt_at, keep_output, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, 'pending', ?, ?, 0, ?, ?, ?, ?)
+                """,
+                (job_id, owner, file_name, file_hash, target_lang, source_lang, queued_path, os.path.getsize(queued_path),
+                 not_before, int(keep_output), now, now),
+            )
+            self._conn.commit()
+        self._wake.release()
+        return job_id
+
+    def lease(self, worker_id):
+        """Claim the next due job no live worker holds, and return it (or None).
+
+        Jobs are taken in fair share order between owners. Jobs whose lease ran out, because their worker died or hung, are claimed again;
+        a job that has already been claimed max_attempts times fails instead.
+        """
+        given_up = []
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so two workers never claim the same job
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    job = self._next_job(now)
+                    if job is None or (job["attempts"] or 0) < self.max_attempts:
+                        break
+                    self._conn.execute(
+                        "UPDATE jobs SET state = 'error', error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? WHERE job_id = ?",
+                        (f"Translation was interrupted {job['attempts']} times. Please translate again.", now, job["job_id"]),
+                    )
+                    given_up.append(job)
+                if job:
+                    job["attempts"] = (job["attempts"] or 0) + 1
+                    self._conn.execute(
+                        "UPDATE jobs SET lease_owner = ?, lease_expires = ?, attempts = ?, started_at = ?, updated_at = ? WHERE job_id = ?",
+                        (worker_id, now + self.lease_seconds, job["attempts"], now, now, job["job_id"]),
+                    )
+                    self._held[job["job_id"]] = worker_id
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        for failed in given_up:
+            logging.error(f"Document job {failed['job_id']} ({failed['file_name']}) gave up after {failed['attempts']} attempts")
+            self._remove_input(failed)
+        if job and job["attempts"] > 1:
+            logging.info(f"Resuming document job {job['job_id']} ({job['file_name']}), attempt {job['attempts']}")
+        return job
+
+    def _waiting_jobs(self, now, due_only=True):
+        # Jobs no live worker holds, oldest first, and how many jobs each owner is running
+        due = "AND (next_attempt_at IS NULL OR next_attempt_at <= ?)" if due_only else ""
+        rows = self._conn.execute(
+            f"""
+            SELECT {', '.join(JOB_COLUMNS)} FROM jobs
+            WHERE state IN ({', '.join('?' * len(ACTIVE_STATES))}) AND (lease_expires IS NULL OR lease_expires < ?) {due}
+            ORDER BY created_at
+            """,
+            (*ACTIVE_STATES, now, now) if due_only else (*ACTIVE_STATES, now),
+        ).fetchall()
+        running = dict(self._conn.execute(
+            "SELECT owner, COUNT(*) FROM jobs WHERE lease_expires >= ? GROUP BY owner", (now,)
+        ).fetchall())
+        return [dict(zip(JOB_COLUMNS, row)) for row in rows], running
+
+    def _fair_order(self, jobs, running, capped=False, limit=None):
+        # Weighted fair share: each pick goes to the owner with the fewest running jobs for
+        # their weight, oldest job first on a tie; when capped, owners at the per-user limit wait
+        queues = {}
+        for job in jobs:
+            queues.setdefault(job["owner"], []).append(job)
+        running = dict(running)
+        order = []
+        while queues and (limit is None or len(order) < limit):
+            owners = [owner for owner in queues if not capped or not self.per_user or running.get(owner, 0) < self.per_user]
+            if not owners:
+                break
+            owner = min(owners, key=lambda owner: ((running.get(owner, 0) + 1) / self.weight(owner), queues[owner][0]["created_at"]))
+            order.append(queues[owner].pop(0))
+            running[owner] = running.get(owner, 0) + 1
+            if not queues[owner]:
+                del queues[owner]
+        return order
+
+    def _next_job(self, now):
+        jobs, running = self._waiting_jobs(now)
+        order = self._fair_order(jobs, running, capped=True, limit=1)
+        return order[0] if order else None
+
+    def queue_positions(self, owner):
+        """Return {job_id: (position, seconds)} for the owner's jobs that wait for a worker.
+
+        position counts the waiting jobs workers will take first under the fair share
+        rules (1 is next); seconds is a rough wait estimate from how long recent jobs
+        ran, or None while no job is running to measure the pace by.
+        """
+        now = time.time()
+        with self._lock:
+            jobs, running = self._waiting_jobs(now, due_only=False)
+            durations = [row[0] for row in self._conn.execute(
+                "SELECT finished_at - started_at FROM jobs WHERE state = 'done' AND started_at IS NOT NULL "
+                "ORDER BY finished_at DESC LIMIT 20"
+            )]
+        slots = sum(running.values())
+        average = sum(durations) / len(durations) if durations else None
+        positions = {}
+        for index, job in enumerate(self._fair_order(jobs, running)):
+            if job["owner"] != owner:
+                continue
+            seconds = math.ceil((index + 1) / slots) * average if slots and average else None
+            if job["next_attempt_at"] and job["next_attempt_at"] > now:
+                seconds = max(seconds or 0, job["next_attempt_at"] - now)
+            positions[job["job_id"]] = (index + 1, seconds)
+        return positions
+
+    def start(self, workers):
+        """Start worker threads in this process that take jobs from the queue until stop()."""
+        for index in range(len(self._workers), len(self._workers) + workers):
+            self._workers.append(self._start_worker(index))
+        if workers:
+            self._keeper = threading.Thread(target=self._keep_leases, name="doc-job-leases", daemon=True)
+            self._keeper.start()
+
+    def _start_worker(self, index):
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+        thread = threading.Thread(target=self.work, args=(worker_id,), name=f"doc-job-{index}", daemon=True)
+        thread.start()
+        return thread
+
+    def healthy(self):
+        """Return False if a worker thread or the lease keeper of this process has died."""
+        threads = self._workers + ([self._keeper] if self._keeper else [])
+        return all(thread.is_alive() for thread in threads)
+
+    def stop(self, timeout=None):
+        """Stop taking jobs and wait up to timeout seconds for the running ones.
+
+        Jobs still running afterwards keep their lease until it runs out, then another
+        worker resumes them.
+        """
+        self._stopping.set()
+        for _ in self._workers:
+            self._wake.release()
+        deadline = None if timeout is None else time.time() + timeout
+        for thread in self._workers:
+            thread.join(None if deadline is None else max(0.0, deadline - time.time()))
+        return not any(thread.is_alive() for thread in self._workers)
+
+    def work(self, worker_id):
+        """Run leased jobs one after another until stop() is called."""
+        failures = 0
+        while not self._stopping.is_set():
+            try:
+                job = self.lease(worker_id)
+                if job is None:
+                    self._wake.acquire(timeout=self.poll_interval)
+                    failures = 0
+                    continue
+                try:
+                    self._run(job, worker_id)
+                finally:
+                    with self._lock:
+                        self._held.pop(job["job_id"], None)
+                failures = 0
+            except Exception:
+                # E.g. the queue stayed locked past the busy timeout; a job this worker held
+                # is resumed by another worker once its lease runs out
+                failures += 1
+                delay = min(60.0, self.poll_interval * 2 ** failures)
+                logging.exception(f"Worker {worker_id} failed, carrying on in {format_duration(delay)}")
+                self._stopping.wait(delay)
+
+    def _keep_leases(self):
+        # Renew well before the lease runs out, so a slow DeepL call never loses a live job
+        while not self._stopping.wait(self.lease_seconds / 3):
+            try:
+                with self._lock:
+                    expires = time.time() + self.lease_seconds
+                    for job_id, worker_id in self._held.items():
+                        self._conn.execute(
+                            "UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND lease_owner = ?", (expires, job_id, worker_id)
+                        )
+                    self._conn.commit()
+            except Exception:
+                logging.exception("Could not renew document job leases")
+            for index, thread in enumerate(self._workers):
+                if not thread.is_alive() and not self._stopping.is_set():
+                    logging.error(f"Document job worker {thread.name} died, restarting it")
+                    self._workers[index] = self._start_worker(index)
+
+    def _should_retry(self, job, e):
+        if job["attempts"] >= self.max_attempts:
+            return False
+        # Network trouble and DeepL overload pass; a rejected document or a spent quota would fail again
+        return isinstance(e, (deepl.ConnectionException, deepl.TooManyRequestsException)) \
+            or getattr(e, "http_status_code", None) in RETRYABLE_STATUS_CODES
+
+    def _run(self, job, worker_id):
+        job_id = job["job_id"]
+        if not job["document_id"] and not (job["input_path"] and os.path.exists(job["input_path"])):
+            self._release(job_id, worker_id, state="error", error="Job was interrupted before upload. Please translate again.")
+            return
+        output_path = os.path.join(self.output_dir, f"{job_id}_{job['target_lang']}_{job['file_name']}")
+        try:
+            # Jobs for the same content and target submitted by different users run once
+            flight_key = (job["file_hash"], job["target_lang"])
+            (result_path, shareable), shared = self._flights.do(flight_key, lambda: self._produce(job, output_path))
+            if shared and not shareable:
+                # The other job's output was not cached and belongs to it alone
+                result_path, shareable = self._produce(job, output_path)
+            elif shared:
+                logging.info(f"Document job {job_id} ({job['file_name']}) shared an identical job's result")
+            if self.on_done:
+                result_path = self.on_done(job, result_path, not shareable) or result_path
+            released = self._release(job_id, worker_id, state="done", output_path=result_path, error=None, finished_at=time.time())
+            logging.info(f"Document job {job_id} ({job['file_name']}) finished")
+        except Exception as e:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            if self._should_retry(job, e):
+                delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+                logging.warning(f"Document job {job_id} ({job['file_name']}) failed on attempt {job['attempts']}, retrying in {format_duration(delay)}: {str(e)}")
+                self._release(job_id, worker_id, state="pending", error=str(e), next_attempt_at=time.time() + delay)
+                return
+            logging.error(f"Document job {job_id} ({job['file_name']}) failed: {str(e)}", exc_info=True)
+            released = self._release(job_id, worker_id, state="error", error=str(e))
+        if released:
+            # Otherwise the input belongs to the worker that took the job over
+            self._remove_input(job)
+
+    def _produce(self, job, output_path):
+        """Translate the job's input and return (final_path, shareable)."""
+        job_id = job["job_id"]
+        handle = deepl.DocumentHandle(job["document_id"], job["document_key"]) if job["document_id"] else None
+        translating_since = job["translating_since"]
+
+        def on_status(state, document=None, **details):
+            nonlocal translating_since
+            if document is not None:
+                details.update(document_id=document.document_id, document_key=document.document_key)
+            if state == "uploading":
+                translating_since = None
+            elif state == "translating" and not translating_since:
+                # Progress and ETA are measured from the moment the translation starts
+                translating_since = time.time()
+            self._update(job_id, state=state, translating_since=translating_since, **details)
+
+        self.translate_document(
+            job["input_path"], output_path, job["target_lang"], job["source_lang"], document=handle, on_status=on_status
+        )
+        stored_path = self.on_complete(job, output_path) if self.on_complete else None
+        return stored_path or output_path, stored_path is not None
+
+    def _remove_input(self, job):
+        try:
+            if job["input_path"] and os.path.exists(job["input_path"]):
+                os.remove(job["input_path"])
+        except Exception as e:
+            logging.error(f"Error cleaning up temporary files: {str(e)}")
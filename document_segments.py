@@ -0,0 +1,143 @@
+import codecs
+import os
+import re
+import sys
+import zipfile
+
+from text_segmenter import MAX_BATCH_BYTES, split_segments, unique_segments, reassemble
+
+SEGMENTABLE_EXTENSIONS = (".txt", ".docx")
+
+# Word parts whose paragraphs are translated segment by segment
+DOCX_TEXT_PARTS = re.compile(r"word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml")
+# A whole <w:p> element; the lookbehind skips empty, self-closing paragraphs
+DOCX_PARAGRAPH = re.compile(r"<w:p\b[^>]*?(?<!/)>.*?</w:p>", re.S)
+DOCX_PARAGRAPH_START = re.compile(r"<w:p\b[^>]*?(?<!/)>")
+DOCX_TEXT = re.compile(r"<w:t[ >]")
+# Text outside the parts above (comments, charts, SmartArt) that only the document API translates
+DOCX_OTHER_TEXT = re.compile(rb"<(w|a):t[ >]")
+
+# DeepL text API options for DOCX paragraphs: keep the WordprocessingML markup and leave field codes alone
+DOCX_OPTIONS = {"tag_handling": "xml", "ignore_tags": ["w:instrText"]}
+
+
+class SegmentedDocument:
+    """A TXT or DOCX file cut into translatable segments that can be put back together.
+
+    TXT files are cut into paragraphs, DOCX files into <w:p> paragraph elements (markup
+    included, so formatting survives). Replacing every segment with its translation and
+    writing the result gives a translated copy of the file.
+    """
+
+    def __init__(self, path, kind, parts, options, has_bom=False):
+        self.path = path
+        self.kind = kind
+        # TXT: one list of (piece, translatable); DOCX: part name -> such a list
+        self.parts = parts
+        self.options = options
+        self.has_bom = has_bom
+
+    def _part_lists(self):
+        return [self.parts] if self.kind == "txt" else list(self.parts.values())
+
+    @property
+    def segments(self):
+        return unique_segments(piece for parts in self._part_lists() for piece in parts)
+
+    def write(self, output_path, translations):
+        if self.kind == "txt":
+            with open(output_path, "wb") as f:
+                if self.has_bom:
+                    f.write(codecs.BOM_UTF8)
+                f.write(reassemble(self.parts, translations).encode("utf-8"))
+            return
+
+        with zipfile.ZipFile(self.path) as source, zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as target:
+            for item in source.infolist():
+                if item.filename in self.parts:
+                    data = reassemble(self.parts[item.filename], translations).encode("utf-8")
+                else:
+                    data = source.read(item.filename)
+                target.writestr(item, data, compress_type=item.compress_type)
+
+
+def _load_txt(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return None
+    # Whole paragraphs, so a translated file splits into the same pieces as its source
+    parts = split_segments(text, max_chars=sys.maxsize)
+    if any(len(piece.encode("utf-8")) > MAX_BATCH_BYTES for piece, translatable in parts if translatable):
+        return None
+    return SegmentedDocument(path, "txt", parts, {}, has_bom=data.startswith(codecs.BOM_UTF8))
+
+
+def _split_paragraphs(xml):
+    parts = []
+    position = 0
+    for match in DOCX_PARAGRAPH.finditer(xml):
+        paragraph = match.group(0)
+        if DOCX_PARAGRAPH_START.search(paragraph, 1):
+            # Nested paragraphs (text boxes) do not split cleanly with a regular expression
+            return None
+        if match.start() > position:
+            parts.append((xml[position:match.start()], False))
+        parts.append((paragraph, bool(DOCX_TEXT.search(paragraph))))
+        position = match.end()
+    if position < len(xml):
+        parts.append((xml[position:], False))
+    return parts
+
+
+def _load_docx(path):
+    parts = {}
+    try:
+        with zipfile.ZipFile(path) as source:
+            for item in source.infolist():
+                data = source.read(item.filename)
+                if DOCX_TEXT_PARTS.fullmatch(item.filename):
+                    paragraphs = _split_paragraphs(data.decode("utf-8"))
+                    if paragraphs is None:
+                        return None
+                    parts[item.filename] = paragraphs
+                elif item.filename.startswith("word/") and item.filename.endswith(".xml") \
+                        and DOCX_OTHER_TEXT.search(data):
+                    return None
+    except (zipfile.BadZipFile, UnicodeDecodeError):
+        return None
+    return SegmentedDocument(path, "docx", parts, DOCX_OPTIONS)
+
+
+def load_segments(path):
+    """Return the file as a SegmentedDocument, or None if it cannot be translated segment by segment."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".txt":
+        return _load_txt(path)
+    if extension == ".docx":
+        return _load_docx(path)
+    return None
+
+
+def align_segments(source, translated):
+    """Pair the segments of a source document with those of its full translation.
+
+    Pieces are paired by position, so a part (or the whole TXT file) only contributes
+    when both sides have the same number of segments. Returns [(source, translation)].
+    """
+    if translated is None or source.kind != translated.kind:
+        return []
+    if source.kind == "txt":
+        pairs = [(source.parts, translated.parts)]
+    else:
+        pairs = [(parts, translated.parts.get(name, [])) for name, parts in source.parts.items()]
+
+    aligned = []
+    for source_parts, translated_parts in pairs:
+        source_segments = [piece for piece, translatable in source_parts if translatable]
+        translated_segments = [piece for piece, translatable in translated_parts if translatable]
+        if len(source_segments) == len(translated_segments):
+            aligned.extend(zip(source_segments, translated_segments))
+    return aligned
@@ -0,0 +1,99 @@
+import math
+import os
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # pypdf is optional, PDFs just won't be split without it
+    PdfReader = PdfWriter = None
+
+# Target size of each part; DeepL rejects or times out on much larger uploads
+PART_BYTES = {
+    ".pdf": 20 * 1024 * 1024,
+    ".txt": 512 * 1024,
+}
+
+
+def can_split(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".pdf":
+        return PdfReader is not None
+    return extension in PART_BYTES
+
+
+def needs_split(path):
+    """True if the file is big enough that it should be translated in parts up front."""
+    extension = os.path.splitext(path)[1].lower()
+    return can_split(path) and os.path.getsize(path) > PART_BYTES[extension]
+
+
+def _part_count(path, minimum=2):
+    extension = os.path.splitext(path)[1].lower()
+    return max(minimum, math.ceil(os.path.getsize(path) / PART_BYTES[extension]))
+
+
+def split_document(input_path, work_dir, parts=None):
+    """Split a PDF by page range or a TXT file at paragraph breaks and return the part paths."""
+    name, extension = os.path.splitext(os.path.basename(input_path))
+    extension = extension.lower()
+    parts = parts or _part_count(input_path)
+    if extension == ".pdf":
+        return _split_pdf(input_path, work_dir, name, parts)
+    if extension == ".txt":
+        return _split_txt(input_path, work_dir, name, parts)
+    raise ValueError(f"Splitting {extension} files is not supported")
+
+
+def _split_pdf(input_path, work_dir, name, parts):
+    reader = PdfReader(input_path)
+    page_count = len(reader.pages)
+    pages_per_part = max(1, math.ceil(page_count / parts))
+    paths = []
+    for index, start in enumerate(range(0, page_count, pages_per_part)):
+        writer = PdfWriter()
+        for page in reader.pages[start:start + pages_per_part]:
+            writer.add_page(page)
+        path = os.path.join(work_dir, f"{name}.part{index:03d}.pdf")
+        with open(path, "wb") as f:
+            writer.write(f)
+        paths.append(path)
+    return paths
+
+
+def _split_txt(input_path, work_dir, name, parts):
+    with open(input_path, "rb") as f:
+        data = f.read()
+    target = max(1, math.ceil(len(data) / parts))
+    paths = []
+    start = 0
+    while start < len(data):
+        end = min(start + target, len(data))
+        if end < len(data):
+            # Prefer to cut at a paragraph break, then a line break
+            cut = data.rfind(b"\n\n", start, end)
+            if cut <= start:
+                cut = data.rfind(b"\n", start, end)
+            if cut > start:
+                end = cut + 1
+        path = os.path.join(work_dir, f"{name}.part{len(paths):03d}.txt")
+        with open(path, "wb") as f:
+            f.write(data[start:end])
+        paths.append(path)
+        start = end
+    return paths
+
+
+def merge_documents(part_paths, output_path):
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension == ".pdf":
+        writer = PdfWriter()
+        for path in part_paths:
+            writer.append(path)
+        with open(output_path, "wb") as f:
+            writer.write(f)
+    elif extension == ".txt":
+        with open(output_path, "wb") as out:
+            for path in part_paths:
+                with open(path, "rb") as f:
+                    out.write(f.read())
+    else:
+        raise ValueError(f"Merging {extension} files is not supported")
@@ -0,0 +1,195 @@
+import logging
+import os
+import secrets
+import shutil
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class DownloadStore:
+    """Hands out single-use, short-lived links that stream finished files from disk.
+
+    Serving a large translation this way costs no memory in the app process, unlike
+    st.download_button which keeps a full copy per session. Files are hard-linked
+    (copied if that is not possible) into <root>/<token>/<file name> and streamed by
+    the store's own endpoint, started with serve(). A link works for one download,
+    and only within ttl_seconds of being handed out, so a URL that ends up in browser
+    history or a proxy log is of no use to anyone else. The endpoint listens on
+    localhost by default and is meant to be reached through the app's proxy.
+    """
+
+    def __init__(self, root, ttl_seconds=300):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.url_prefix = None
+        self._lock = threading.Lock()
+        # token -> (key, expiry, on_download) for links not downloaded yet
+        self._tokens = {}
+        # (source path, mtime, file name) -> token, so reruns reuse a link that is still unused
+        self._published = {}
+        self._last_cleanup = 0.0
+        if not os.path.exists(root):
+            os.makedirs(root)
+        # Clears what an earlier run left behind
+        self.cleanup(force=True)
+
+    def publish(self, path, file_name, on_download=None):
+        """Make path downloadable once as file_name and return its URL.
+
+        on_download, if given, is called without arguments when the link is used.
+        """
+        if not self.url_prefix:
+            raise RuntimeError("The download endpoint is not running; call serve() first")
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime, file_name)
+        now = time.time()
+        with self._lock:
+            token = self._published.get(key)
+            if not (token and token in self._tokens and self._tokens[token][1] > now):
+                token = secrets.token_urlsafe(24)
+                target_dir = os.path.join(self.root, token)
+                os.makedirs(target_dir)
+                target = os.path.join(target_dir, file_name)
+                try:
+                    os.link(path, target)
+                except OSError:
+                    shutil.copyfile(path, target)
+                self._tokens[token] = (key, now + self.ttl_seconds, on_download)
+                self._published[key] = token
+        self.cleanup()
+        return f"{self.url_prefix}/{token}/{urllib.parse.quote(file_name)}"
+
+    def _valid(self, token):
+        with self._lock:
+            entry = self._tokens.get(token)
+            return entry is not None and entry[1] > time.time()
+
+    def _claim(self, token):
+        # The first download uses the link up; later ones get 404
+        with self._lock:
+            entry = self._tokens.pop(token, None)
+            if entry is None:
+                return False
+            if self._published.get(entry[0]) == token:
+                del self._published[entry[0]]
+            if entry[1] <= time.time():
+                return False
+        if entry[2] is not None:
+            try:
+                entry[2]()
+            except Exception as e:
+                logging.error(f"Error recording download: {str(e)}")
+        return True
+
+    def _remove(self, token):
+        shutil.rmtree(os.path.join(self.root, token), ignore_errors=True)
+
+    def cleanup(self, force=False):
+        """Remove links that expired unused (checked at most once a minute).
+
+        Other app processes may share root, so a directory this store does not know
+        about is only removed once it is older than any link could live.
+        """
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_cleanup < 60:
+                return
+            self._last_cleanup = now
+            expired = set()
+            for token, (key, expires, _) in list(self._tokens.items()):
+                if expires <= now:
+                    del self._tokens[token]
+                    expired.add(token)
+                    if self._published.get(key) == token:
+                        del self._published[key]
+            live = set(self._tokens)
+        for token in os.listdir(self.root):
+            directory = os.path.join(self.root, token)
+            try:
+                if token in expired or (token not in live and now - os.path.getmtime(directory) > self.ttl_seconds):
+                    shutil.rmtree(directory)
+            except OSError as e:
+                logging.error(f"Error cleaning up download {token}: {str(e)}")
+
+    def serve(self, port, url_prefix, address="127.0.0.1"):
+        """Stream published files on address:port, reachable by browsers at url_prefix."""
+        store = self
+
+        class Handler(_DownloadHandler):
+            root = os.path.realpath(store.root)
+
+            def valid(self, token):
+                return store._valid(token)
+
+            def claim(self, token):
+                return store._claim(token)
+
+            def finished(self, token):
+                store._remove(token)
+
+        server = ThreadingHTTPServer((address, port), Handler)
+        threading.Thread(target=server.serve_forever, name="download-http", daemon=True).start()
+        self.url_prefix = url_prefix.rstrip("/")
+        logging.info(f"Serving downloads on {address}:{port}")
+        return server
+
+
+class _DownloadHandler(BaseHTTPRequestHandler):
+    root = None
+    chunk_size = 1024 * 1024
+
+    def _resolve(self):
+        parts = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).strip("/").split("/")
+        # The proxy may forward the path with its own prefix in front
+        parts = parts[-2:]
+        if len(parts) != 2 or any(part in ("", ".", "..") for part in parts):
+            return None, None
+        path = os.path.realpath(os.path.join(self.root, *parts))
+        if os.path.commonpath([path, self.root]) != self.root or not os.path.isfile(path):
+            return None, None
+        return parts[0], path
+
+    def _send_headers(self, path):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        file_name = urllib.parse.quote(os.path.basename(path))
+        self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{file_name}")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Referrer-Policy", "no-referrer")
+        self.send_header("X-Content-Type-Options", "nosniff")
+        self.end_headers()
+
+    def do_HEAD(self):
+        token, path = self._resolve()
+        if not path or not self.valid(token):
+            self.send_error(404)
+            return
+        self._send_headers(path)
+
+    def do_GET(self):
+        token, path = self._resolve()
+        if not path or not self.claim(token):
+            self.send_error(404)
+            return
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(404)
+            return
+        try:
+            with f:
+                self._send_headers(path)
+                try:
+                    # Streamed in chunks, so a large file costs no memory
+                    shutil.copyfileobj(f, self.wfile, self.chunk_size)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+        finally:
+            self.finished(token)
+
+    def log_message(self, format, *args):
+        # Request lines contain the link itself
+        pass
@@ -0,0 +1,1156 @@
+"""Translation engine shared by the Streamlit app and the batch CLI.
+
+Nothing in here imports Streamlit or reads configuration at import time, so the
+engine can be scripted; settings come from the environment on first use.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import deepl
+import requests
+from cachetools import TTLCache
+
+import metrics
+from admission import AdmissionController, parse_weights
+from artifact_store import ArtifactStore
+from deepl_client import DeepLClientPool
+from document_cache import DocumentCache, hash_stream
+from document_jobs import DocumentJobManager, estimate_progress, describe_progress, format_duration
+from document_segments import SEGMENTABLE_EXTENSIONS, load_segments, align_segments
+from language_detection import LanguageCache, extract_sample, same_language
+from document_splitter import can_split, needs_split, split_document, merge_documents
+from rate_limiter import DeepLScheduler, MIN_DOCUMENT_CHARACTERS
+from single_flight import SingleFlight
+from image_optimizer import can_optimize, optimize_office_images
+from text_segmenter import split_segments, unique_segments, make_batches, reassemble
+from translation_memory import TranslationMemory, make_key
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".pptx", ".txt")
+
+
+class Settings:
+    """Engine settings, read from the environment when first needed."""
+
+    def __init__(self):
+        self.deepl_auth_key = os.getenv("DEEPL_API_KEY")
+        self.deepl_server_url = os.getenv("DEEPL_SERVER_URL") or None
+        self.deepl_pool_size = int(os.getenv("DEEPL_POOL_SIZE", "8"))
+        self.deepl_interactive_clients = int(os.getenv("DEEPL_INTERACTIVE_CLIENTS", "2"))
+        self.deepl_timeout = float(os.getenv("DEEPL_TIMEOUT", "10"))
+        self.deepl_max_retries = int(os.getenv("DEEPL_MAX_RETRIES", "2"))
+        self.deepl_health_check_interval = int(os.getenv("DEEPL_HEALTH_CHECK_INTERVAL", "300"))
+        self.deepl_requests_per_second = float(os.getenv("DEEPL_REQUESTS_PER_SECOND", "10"))
+        self.deepl_characters_per_second = float(os.getenv("DEEPL_CHARACTERS_PER_SECOND", "0"))
+        self.deepl_retry_attempts = int(os.getenv("DEEPL_RETRY_ATTEMPTS", "4"))
+        self.deepl_usage_check_interval = int(os.getenv("DEEPL_USAGE_CHECK_INTERVAL", "60"))
+        self.cache_dir = os.getenv("CACHE_DIR", "./cache_files")
+        self.tm_memory_entries = int(os.getenv("TM_MEMORY_ENTRIES", "1024"))
+        self.tm_disk_entries = int(os.getenv("TM_DISK_ENTRIES", "100000"))
+        self.tm_ttl_seconds = int(os.getenv("TM_TTL_SECONDS", str(30 * 24 * 3600)))
+        self.revision_min_reuse = float(os.getenv("REVISION_MIN_REUSE", "0.5"))
+        self.language_sample_chars = int(os.getenv("LANGUAGE_SAMPLE_CHARS", "1000"))
+        self.doc_cache_max_mb = int(os.getenv("DOC_CACHE_MAX_MB", "2048"))
+        self.artifact_max_mb = int(os.getenv("ARTIFACT_MAX_MB", "1024"))
+        self.artifact_ttl_hours = float(os.getenv("ARTIFACT_TTL_HOURS", "72"))
+        self.doc_workers = int(os.getenv("DOC_WORKERS", "4"))
+        self.archive_max_entries = int(os.getenv("ARCHIVE_MAX_ENTRIES", "1000"))
+        self.archive_max_mb = int(os.getenv("ARCHIVE_MAX_MB", "2048"))
+        self.archive_max_ratio = float(os.getenv("ARCHIVE_MAX_RATIO", "100"))
+        # Worker threads the app runs for the job queue; 0 when worker.py processes run the jobs
+        self.job_workers = int(os.getenv("JOB_WORKERS", os.getenv("DOC_WORKERS", "4")))
+        self.job_lease_seconds = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+        self.job_max_attempts = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+        self.job_retry_delay = float(os.getenv("JOB_RETRY_DELAY", "30"))
+        self.user_concurrency = int(os.getenv("USER_CONCURRENCY", "2"))
+        self.user_characters_per_second = float(os.getenv("USER_CHARACTERS_PER_SECOND", "0"))
+        self.user_burst_seconds = float(os.getenv("USER_BURST_SECONDS", "60"))
+        self.user_weights = os.getenv("USER_WEIGHTS", "")
+        self.short_text_chars = int(os.getenv("SHORT_TEXT_CHARS", "5000"))
+        self.text_workers = int(os.getenv("TEXT_WORKERS", "4"))
+        self.image_max_dimension = int(os.getenv("IMAGE_MAX_DIMENSION", "1600"))
+        self.image_jpeg_quality = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+        self.metrics_port = int(os.getenv("METRICS_PORT", "0")) or None
+        self.metrics_dump_path = os.getenv("METRICS_DUMP_PATH") or None
+        self.metrics_dump_interval = int(os.getenv("METRICS_DUMP_INTERVAL", "60"))
+        self.graph_me_url = os.getenv("GRAPH_ME_URL", "https://graph.microsoft.com/v1.0/me")
+        self.graph_profile_ttl = int(os.getenv("GRAPH_PROFILE_TTL", "300"))
+        self.graph_timeout = float(os.getenv("GRAPH_TIMEOUT", "10"))
+        self.temp_dir = "./temp_files"
+        self.output_dir = "./output_files"
+
+
+_settings = None
+_resources = {}
+_resources_lock = threading.RLock()
+
+
+def get_settings():
+    global _settings
+    with _resources_lock:
+        if _settings is None:
+            _settings = Settings()
+        return _settings
+
+
+def configure(**overrides):
+    """Override settings before the engine is first used (e.g. from command-line flags)."""
+    settings = get_settings()
+    for name, value in overrides.items():
+        if not hasattr(settings, name):
+            raise AttributeError(f"Unknown setting: {name}")
+        setattr(settings, name, value)
+
+
+def _resource(name, factory):
+    # Process-wide singletons, created on first use and shared by every caller
+    with _resources_lock:
+        if name not in _resources:
+            _resources[name] = factory()
+        return _resources[name]
+
+
+def get_deepl_pool():
+    # Shared by every session so HTTP connections are reused instead of re-established
+    settings = get_settings()
+    return _resource("deepl_pool", lambda: DeepLClientPool(
+        settings.deepl_auth_key,
+        size=settings.deepl_pool_size,
+        server_url=settings.deepl_server_url,
+        timeout=settings.deepl_timeout,
+        max_retries=settings.deepl_max_retries,
+        health_check_interval=settings.deepl_health_check_interval,
+        reserved=settings.deepl_interactive_clients
+    ))
+
+
+def get_scheduler():
+    # One scheduler per process, since the rate limits and quota belong to the API key
+    settings = get_settings()
+    return _resource("deepl_scheduler", lambda: DeepLScheduler(
+        get_deepl_pool().call,
+        requests_per_second=settings.deepl_requests_per_second,
+        characters_per_second=settings.deepl_characters_per_second,
+        max_attempts=settings.deepl_retry_attempts,
+        usage_check_interval=settings.deepl_usage_check_interval
+    ))
+
+
+def call_deepl(fn, characters=0, interactive=False):
+    # Interactive calls (short pasted text) go ahead of bulk document work
+    return get_scheduler().call(fn, characters=characters, interactive=interactive)
+
+
+def check_quota(characters):
+    get_scheduler().check_quota(characters)
+
+
+def estimate_document_characters(input_path):
+    # Plain text is billed per character; other formats are billed at least the DeepL minimum
+    if os.path.splitext(input_path)[1].lower() == ".txt":
+        return os.path.getsize(input_path)
+    return MIN_DOCUMENT_CHARACTERS
+
+
+def check_document_quota(input_path, copies=1):
+    check_quota(estimate_document_characters(input_path) * copies)
+
+
+def get_admission():
+    # Fair share between signed-in users: text requests wait their turn here, and the
+    # job queue uses the same per-user weights and limits for documents
+    settings = get_settings()
+    return _resource("admission", lambda: AdmissionController(
+        capacity=settings.text_workers,
+        per_user=settings.user_concurrency,
+        characters_per_second=settings.user_characters_per_second,
+        burst_seconds=settings.user_burst_seconds,
+        weights=parse_weights(settings.user_weights),
+        short_characters=settings.short_text_chars
+    ))
+
+
+def get_translation_memory():
+    # Shared by all sessions so repeated paragraphs are only billed once
+    settings = get_settings()
+    return _resource("translation_memory", lambda: TranslationMemory(
+        os.path.join(settings.cache_dir, "translation_memory.sqlite3"),
+        max_memory_entries=settings.tm_memory_entries,
+        max_disk_entries=settings.tm_disk_entries,
+        ttl_seconds=settings.tm_ttl_seconds
+    ))
+
+
+def get_segment_memory():
+    # Source segment -> translated segment for TXT/DOCX documents, learned from full
+    # translations so that later revisions only send their changed segments
+    settings = get_settings()
+    return _resource("segment_memory", lambda: TranslationMemory(
+        os.path.join(settings.cache_dir, "document_segments.sqlite3"),
+        max_memory_entries=settings.tm_memory_entries,
+        max_disk_entries=settings.tm_disk_entries,
+        ttl_seconds=settings.tm_ttl_seconds
+    ))
+
+
+def get_document_cache():
+    settings = get_settings()
+    return _resource("document_cache", lambda: DocumentCache(
+        os.path.join(settings.cache_dir, "documents"),
+        max_bytes=settings.doc_cache_max_mb * 1024 * 1024
+    ))
+
+
+def get_artifact_store():
+    # Finished translations per user, kept so they can be downloaded again
+    settings = get_settings()
+    return _resource("artifact_store", lambda: ArtifactStore(
+        os.path.join(settings.cache_dir, "artifacts"),
+        max_bytes=settings.artifact_max_mb * 1024 * 1024,
+        ttl_seconds=int(settings.artifact_ttl_hours * 3600)
+    ))
+
+
+def get_graph_session():
+    # Pooled keep-alive connections to Graph, shared by all sessions
+    return _resource("graph_session", requests.Session)
+
+
+def get_profile_cache():
+    # Graph profiles per access token, so reruns don't call Graph
+    settings = get_settings()
+    return _resource("profile_cache", lambda: (TTLCache(maxsize=1024, ttl=settings.graph_profile_ttl), threading.Lock()))
+
+
+def lookup_graph_profile(token):
+    """Return (profile, status_code) for the signed-in user, from the cache when possible.
+
+    profile is None when Graph refused the token; a 401 status means it has expired.
+    """
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    cache, lock = get_profile_cache()
+    with lock:
+        profile = cache.get(key)
+    metrics.GRAPH_PROFILE_LOOKUPS.inc(result="miss" if profile is None else "hit")
+    if profile is not None:
+        return profile, 200
+
+    settings = get_settings()
+    with metrics.span("graph_lookup"):
+        response = get_graph_session().get(
+            settings.graph_me_url, headers={"Authorization": f"Bearer {token}"}, timeout=settings.graph_timeout
+        )
+    if response.status_code != 200:
+        return None, response.status_code
+    profile = response.json()
+    with lock:
+        cache[key] = profile
+    return profile, 200
+
+
+def get_text_executor():
+    return _resource("text_executor", lambda: ThreadPoolExecutor(
+        max_workers=get_settings().text_workers, thread_name_prefix="text-translate"
+    ))
+
+
+def get_part_executor():
+    # Parts of split documents, shared by every job in the process; the job worker itself
+    # only waits for its parts, so it never takes one of these threads
+    return _resource("part_executor", lambda: ThreadPoolExecutor(
+        max_workers=get_settings().doc_workers, thread_name_prefix="doc-part"
+    ))
+
+
+def get_text_flights():
+    return _resource("text_flights", SingleFlight)
+
+
+def get_document_flights():
+    return _resource("document_flights", SingleFlight)
+
+
+def _collect_engine_metrics():
+    # Reports on the components that already exist; scraping never creates one
+    samples = []
+    for name in ("translation_memory", "segment_memory"):
+        memory = _resources.get(name)
+        if memory:
+            stats = memory.stats()
+            for result, value in [("hit", stats["memory_hits"] + stats["disk_hits"]), ("miss", stats["misses"])]:
+                samples.append(("translator_cache_lookups_total", "counter", "Cache lookups, by cache and result",
+                                {"cache": name, "result": result}, value))
+    document_cache = _resources.get("document_cache")
+    if document_cache:
+        stats = document_cache.stats()
+        for result, value in [("hit", stats["hits"]), ("miss", stats["misses"])]:
+            samples.append(("translator_cache_lookups_total", "counter", "Cache lookups, by cache and result",
+                            {"cache": "document", "result": result}, value))
+        samples.append(("translator_document_cache_bytes", "gauge", "Bytes held in the document cache", {}, stats["bytes"]))
+    artifact_store = _resources.get("artifact_store")
+    if artifact_store:
+        samples.append(("translator_artifact_store_bytes", "gauge", "Bytes held in the per-user artifact store", {}, artifact_store.stats()["bytes"]))
+    job_manager = _resources.get("job_manager")
+    if job_manager:
+        for state, count in job_manager.queue_stats().items():
+            samples.append(("translator_document_jobs", "gauge", "Unfinished document jobs, by state", {"state": state}, count))
+    admission = _resources.get("admission")
+    if admission:
+        stats = admission.stats()
+        samples.append(("translator_admission_requests", "gauge", "Text requests admitted or waiting for their turn",
+                        {"status": "running"}, stats["running"]))
+        samples.append(("translator_admission_requests", "gauge", "Text requests admitted or waiting for their turn",
+                        {"status": "waiting"}, stats["waiting"]))
+    scheduler = _resources.get("deepl_scheduler")
+    if scheduler:
+        stats = scheduler.stats()
+        samples.append(("translator_deepl_retries_total", "counter", "DeepL calls retried after 429/5xx", {}, stats["retries"]))
+        samples.append(("translator_deepl_throttled_seconds_total", "counter", "Time calls waited for the rate limiter", {}, stats["throttled_seconds"]))
+    for name in ("text_flights", "document_flights"):
+        flights = _resources.get(name)
+        if flights:
+            stats = flights.stats()
+            samples.append(("translator_coalesced_requests_total", "counter", "Requests that shared an identical in-flight translation",
+                            {"kind": name.split("_")[0]}, stats["coalesced"]))
+    return samples
+
+
+def start_metrics():
+    """Start the metrics endpoint and/or periodic dump configured in the settings (once per process)."""
+    def start():
+        settings = get_settings()
+        metrics.REGISTRY.add_collector(_collect_engine_metrics)
+        if settings.metrics_port:
+            try:
+                metrics.start_http_server(settings.metrics_port)
+            except OSError as e:
+                logging.error(f"Could not serve metrics on port {settings.metrics_port}: {str(e)}")
+        if settings.metrics_dump_path:
+            metrics.start_dump(settings.metrics_dump_path, settings.metrics_dump_interval)
+        return True
+    return _resource("metrics", start)
+
+
+# Text translation
+
+def translate_batch(batch, target_language, interactive=False, **options):
+    # Sessions sending the same batch at the same moment share one DeepL call
+    payload = json.dumps([batch, options], ensure_ascii=False, sort_keys=True)
+    flight_key = (hashlib.sha256(payload.encode("utf-8")).hexdigest(), target_language)
+    characters = sum(len(text) for text in batch)
+    results, _ = get_text_flights().do(
+        flight_key, lambda: call_deepl(
+            lambda translator: translator.translate_text(text=batch, target_lang=target_language, **options),
+            characters=characters,
+            interactive=interactive
+        )
+    )
+    return batch, results
+
+
+def translate_text_cached(text, target_language, source_language=None):
+    """Translate text segment by segment and return (translated_text, segments_from_memory, total_segments)."""
+    with metrics.span("text_translate", target_lang=target_language):
+        translated, from_memory, total = _translate_text_cached(text, target_language, source_language)
+    metrics.TEXT_CHARACTERS.inc(len(text), target_lang=target_language)
+    return translated, from_memory, total
+
+
+def _translate_segments(segments, target_language, source_language=None, interactive=False):
+    """Translate unique segments through the translation memory.
+
+    Returns ({segment: {"text", "detected_source_lang"}}, segments_from_memory).
+    """
+    memory = get_translation_memory()
+    translations = {}
+    keys = {}
+    missing = []
+    for segment in segments:
+        keys[segment] = make_key(segment, target_language)
+        cached = memory.get(keys[segment])
+        if cached is not None:
+            translations[segment] = cached
+        else:
+            missing.append(segment)
+    from_memory = len(segments) - len(missing)
+    if from_memory:
+        logging.info(f"Translation memory hit for {from_memory}/{len(segments)} segments ({target_language})")
+
+    if missing:
+        check_quota(sum(len(segment) for segment in missing))
+        # A known source language saves DeepL detecting it again
+        options = {"source_lang": source_language} if source_language else {}
+        batches = make_batches(missing)
+        if len(batches) == 1:
+            completed = [translate_batch(batches[0], target_language, interactive, **options)]
+        else:
+            executor = get_text_executor()
+            completed = executor.map(lambda batch: translate_batch(batch, target_language, interactive, **options), batches)
+        for batch, results in completed:
+            for segment, result in zip(batch, results):
+                translations[segment] = {"text": result.text, "detected_source_lang": result.detected_source_lang}
+            # One transaction per batch, not per segment
+            memory.put_many(
+                [(keys[segment], result.text, result.detected_source_lang) for segment, result in zip(batch, results)],
+                target_language
+            )
+
+    return translations, from_memory
+
+
+def _translate_text_cached(text, target_language, source_language=None):
+    parts = split_segments(text)
+    segments = unique_segments(parts)
+    interactive = len(text) <= get_settings().short_text_chars
+    translations, from_memory = _translate_segments(segments, target_language, source_language, interactive)
+    return reassemble(parts, {segment: entry["text"] for segment, entry in translations.items()}), from_memory, len(segments)
+
+
+# Source language detection
+
+def get_language_cache():
+    return _resource("language_cache", lambda: LanguageCache(
+        os.path.join(get_settings().cache_dir, "source_languages.sqlite3")
+    ))
+
+
+def _detect_segments_language(segments, target_language, interactive=False):
+    # Returns (language, segments translated just now); the language of most characters wins
+    translations, from_memory = _translate_segments(segments, target_language, interactive=interactive)
+    votes = {}
+    for segment, entry in translations.items():
+        if entry["detected_source_lang"]:
+            language = entry["detected_source_lang"].upper()
+            votes[language] = votes.get(language, 0) + len(segment)
+    return (max(votes, key=votes.get) if votes else None), len(segments) - from_memory
+
+
+def detect_language(sample, target_language):
+    """Return the language DeepL detects for a text sample, or None.
+
+    The sample goes through the translation memory like any pasted text, so the
+    call costs only the sample's characters, once.
+    """
+    if not sample.strip():
+        return None
+    return _detect_segments_language(unique_segments(split_segments(sample)), target_language)[0]
+
+
+def detect_text_language(text, target_language):
+    """Detect the language of pasted text from its first whole segments.
+
+    Those segments land in the translation memory, so translating the text afterwards
+    does not pay for them again. Returns (language or None, segments translated to
+    detect it).
+    """
+    settings = get_settings()
+    if not settings.language_sample_chars:
+        return None, 0
+    sample = []
+    for segment in unique_segments(split_segments(text)):
+        sample.append(segment)
+        if sum(len(piece) for piece in sample) >= settings.language_sample_chars:
+            break
+    if not sample:
+        return None, 0
+    try:
+        # The sample is short, so it always takes the interactive lane
+        return _detect_segments_language(sample, target_language, interactive=True)
+    except Exception as e:
+        logging.warning(f"Could not detect the language of the text: {str(e)}")
+        return None, 0
+
+
+def detect_document_language(source, file_name, content_hash, target_language):
+    """Detect the source language of a document from a sample of its first pages.
+
+    source is a path or a binary file object. The result is cached per content hash.
+    Detection is best-effort: if it fails, None is returned and DeepL detects the
+    language itself during translation.
+    """
+    settings = get_settings()
+    if not settings.language_sample_chars:
+        return None
+    cache = get_language_cache()
+    language = cache.get(content_hash)
+    if language:
+        return language
+    try:
+        with metrics.span("language_detect", format=metrics.file_format(file_name)):
+            sample = extract_sample(source, file_name, settings.language_sample_chars)
+            language = detect_language(sample, target_language)
+    except Exception as e:
+        logging.warning(f"Could not detect the language of {file_name}: {str(e)}")
+        return None
+    if language:
+        logging.info(f"Detected {language} as the source language of {file_name}")
+        cache.put(content_hash, language)
+    return language
+
+
+# Document translation
+
+def ensure_work_dirs():
+    # Create temp directory if it doesn't exist
+    settings = get_settings()
+    for directory in [settings.temp_dir, settings.output_dir]:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+
+def temp_path(file_name):
+    return os.path.join(get_settings().temp_dir, f"{uuid.uuid4().hex}_{file_name}")
+
+
+def translate_document_in_parts(input_path, output_path, target_language, on_progress=None, source_language=None):
+    """Split a large PDF/TXT, translate the parts concurrently and merge the results."""
+    work_dir = os.path.join(get_settings().temp_dir, f"parts_{uuid.uuid4().hex}")
+    os.makedirs(work_dir)
+    try:
+        part_paths = split_document(input_path, work_dir)
+        logging.info(f"Translating {os.path.basename(input_path)} in {len(part_paths)} parts")
+        started = time.time()
+        finished = []
+        lock = threading.Lock()
+
+        def translate_part(part_path):
+            translated_path = part_path + ".translated" + os.path.splitext(part_path)[1]
+            call_deepl(lambda translator: translator.translate_document_from_filepath(
+                input_path=part_path,
+                output_path=translated_path,
+                source_lang=source_language,
+                target_lang=target_language
+            ))
+            if on_progress:
+                with lock:
+                    finished.append(part_path)
+                    done = len(finished)
+                elapsed = time.time() - started
+                # Assume the remaining parts take as long as the finished ones did on average
+                seconds_remaining = elapsed / done * (len(part_paths) - done)
+                on_progress(
+                    estimate_progress("translating", elapsed, seconds_remaining),
+                    f"Translated part {done} of {len(part_paths)} ({elapsed:.0f}s elapsed)"
+                )
+            return translated_path
+
+        translated_paths = list(get_part_executor().map(translate_part, part_paths))
+        merge_documents(translated_paths, output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _translate_document_remote(input_path, output_path, target_language, source_language=None, document=None,
+                               on_status=None):
+    """Upload, poll and download one document, passing DeepL's real status to on_status.
+
+    This is what translate_document_from_filepath does, split into its steps so each
+    status poll (queued/translating, seconds remaining) can be reported. document is
+    the handle of an earlier upload of the same file, which is followed instead of
+    uploading again.
+    """
+    def report(state, **details):
+        if on_status:
+            on_status(state, **details)
+
+    if document is None:
+        report("uploading")
+        with open(input_path, "rb") as input_file:
+            def upload(translator):
+                # Rewind in case a previous attempt consumed part of the file
+                input_file.seek(0)
+                return translator.translate_document_upload(
+                    input_file, source_lang=source_language, target_lang=target_language,
+                    filename=os.path.basename(input_path)
+                )
+            document = call_deepl(upload)
+        report("queued", document=document)
+
+    while True:
+        status = call_deepl(lambda translator: translator.translate_document_get_status(document))
+        if not status.ok:
+            raise deepl.DocumentTranslationException(
+                f"Error occurred while translating document: {status.error_message or 'unknown error'}",
+                document,
+            )
+        state = "queued" if status.status == deepl.DocumentStatus.Status.QUEUED else "translating"
+        report(state, seconds_remaining=status.seconds_remaining, billed_characters=status.billed_characters)
+        if status.done:
+            break
+        # Poll about twice as often as DeepL expects to finish, within 1-5 seconds
+        time.sleep(min(max((status.seconds_remaining or 2) / 2, 1.0), 5.0))
+
+    report("downloading", seconds_remaining=0)
+    with open(output_path, "wb") as output_file:
+        def download(translator):
+            output_file.seek(0)
+            output_file.truncate()
+            translator.translate_document_download(document, output_file)
+        call_deepl(download)
+
+
+def translate_revision(input_path, output_path, target_language, on_progress=None, source_language=None,
+                       on_status=None):
+    """Translate a TXT/DOCX file reusing the segment memory, sending only unknown segments to DeepL.
+
+    Returns False, without calling DeepL, when less than REVISION_MIN_REUSE of the file
+    (by characters) has been translated before; the caller then translates it whole.
+    Otherwise on_status("translating") is called before any segment is sent.
+    """
+    if os.path.splitext(input_path)[1].lower() not in SEGMENTABLE_EXTENSIONS:
+        return False
+    document = load_segments(input_path)
+    if document is None:
+        return False
+
+    memory = get_segment_memory()
+    translations = {}
+    keys = {}
+    missing = []
+    for segment in document.segments:
+        keys[segment] = make_key(segment, target_language, **document.options)
+        cached = memory.get(keys[segment])
+        if cached is not None:
+            translations[segment] = cached["text"]
+        else:
+            missing.append(segment)
+    total_characters = sum(len(segment) for segment in keys)
+    reused_characters = sum(len(segment) for segment in translations)
+    if not total_characters or reused_characters / total_characters < get_settings().revision_min_reuse:
+        return False
+
+    file_name = os.path.basename(input_path)
+    logging.info(f"Revision of {file_name}: reusing {len(translations)}/{len(keys)} segments ({target_language})")
+    if on_status:
+        on_status("translating")
+    metrics.DOCUMENT_SEGMENTS.inc(len(translations), source="memory")
+    metrics.DOCUMENT_SEGMENTS.inc(len(missing), source="deepl")
+    if missing:
+        check_quota(sum(len(segment) for segment in missing))
+        options = dict(document.options, source_lang=source_language) if source_language else document.options
+        batches = make_batches(missing)
+        started = time.time()
+        completed = get_text_executor().map(
+            lambda batch: translate_batch(batch, target_language, **options), batches
+        )
+        reused = len(translations)
+        sent = 0
+        for done, (batch, results) in enumerate(completed, 1):
+            for segment, result in zip(batch, results):
+                translations[segment] = result.text
+            memory.put_many(
+                [(keys[segment], result.text, result.detected_source_lang) for segment, result in zip(batch, results)],
+                target_language
+            )
+            sent += len(batch)
+            if on_progress:
+                elapsed = time.time() - started
+                on_progress(
+                    estimate_progress("translating", elapsed, elapsed / done * (len(batches) - done)),
+                    f"Translated {sent} of {len(missing)} changed segments ({reused} reused)"
+                )
+    document.write(output_path, translations)
+    return True
+
+
+def remember_segments(input_path, output_path, target_language):
+    """Store the segment alignment of a full TXT/DOCX translation for later revisions."""
+    if os.path.splitext(input_path)[1].lower() not in SEGMENTABLE_EXTENSIONS:
+        return
+    try:
+        source = load_segments(input_path)
+        if source is None:
+            return
+        pairs = align_segments(source, load_segments(output_path))
+        get_segment_memory().put_many(
+            [(make_key(segment, target_language, **source.options), translation) for segment, translation in pairs],
+            target_language
+        )
+    except Exception as e:
+        # Only a later revision is affected, so never fail the translation over it
+        logging.warning(f"Could not store segments of {os.path.basename(input_path)}: {str(e)}")
+
+
+def translate_document(input_path, output_path, target_language, source_language=None, document=None,
+                       on_status=None, on_progress=None):
+    """Translate one document into output_path; the batch CLI and the document job workers both run this.
+
+    A revision of a TXT/DOCX file that was translated before is put together from the
+    segment memory. Anything else is translated whole: very large PDF/TXT files in
+    parts, the rest through DeepL's upload/status/download steps, in parts after all
+    if the connection fails. Whole translations are then remembered segment by segment.
+
+    on_status(state, **details) follows the steps as job states (translating, uploading,
+    queued, downloading) with seconds_remaining and billed_characters where DeepL reports
+    them, and document, the DeepL handle, right after the upload. Passing that handle
+    back as document resumes the translation without uploading again. on_progress
+    (fraction, message) gets the finer progress of revisions and split translations.
+    """
+    with metrics.span("translate", format=metrics.file_format(input_path), target_lang=target_language):
+        revised = document is None and translate_revision(
+            input_path, output_path, target_language, on_progress, source_language, on_status
+        )
+        if not revised:
+            if document is None:
+                check_document_quota(input_path)
+            _translate_whole(input_path, output_path, target_language, source_language, document, on_status, on_progress)
+            remember_segments(input_path, output_path, target_language)
+    metrics.record_document(input_path, target_language)
+
+
+def _translate_whole(input_path, output_path, target_language, source_language, document, on_status, on_progress):
+    def in_parts():
+        if on_status:
+            on_status("translating")
+        translate_document_in_parts(input_path, output_path, target_language, on_progress, source_language)
+
+    # Very large PDF/TXT files go straight to split-translate-merge
+    if document is None and needs_split(input_path):
+        in_parts()
+        return
+
+    try:
+        # Translate document on pooled clients, which reconnect on their own if the connection broke
+        _translate_document_remote(input_path, output_path, target_language, source_language, document, on_status)
+    except deepl.ConnectionException:
+        if document is not None or not can_split(input_path):
+            raise
+        logging.warning(f"Connection failed for {os.path.basename(input_path)}, retrying in parts")
+        _remove_quietly(output_path)
+        in_parts()
+
+
+def translate_document_file(input_path, output_path, target_language, on_progress=None, source_language=None):
+    """Run translate_document, turning its job states into on_progress(fraction, message) calls."""
+    started = time.time()
+    translating_since = None
+
+    def on_status(state, seconds_remaining=None, **details):
+        nonlocal translating_since
+        if state == "translating" and translating_since is None:
+            translating_since = time.time()
+        translating_seconds = time.time() - translating_since if translating_since else 0.0
+        on_progress(
+            estimate_progress(state, translating_seconds, seconds_remaining),
+            describe_progress(state, time.time() - started, seconds_remaining)
+        )
+
+    translate_document(
+        input_path, output_path, target_language, source_language,
+        on_status=on_status if on_progress else None, on_progress=on_progress
+    )
+
+
+def cache_hash_for(file_hash, optimize_images):
+    # Compressed uploads translate to a different file, so they are cached separately
+    if optimize_images:
+        return hashlib.sha256(f"{file_hash}:optimized-images".encode("utf-8")).hexdigest()
+    return file_hash
+
+
+def preprocess_document(input_path, optimize_images):
+    """Run the optional preprocessing stages on a saved upload and return a note for the user, or None."""
+    if not (optimize_images and can_optimize(input_path)):
+        return None
+
+    settings = get_settings()
+    optimized_path = input_path + ".optimized" + os.path.splitext(input_path)[1]
+    size_before, size_after = optimize_office_images(
+        input_path, optimized_path,
+        max_dimension=settings.image_max_dimension,
+        jpeg_quality=settings.image_jpeg_quality
+    )
+    if size_after < size_before:
+        os.replace(optimized_path, input_path)
+    else:
+        os.remove(optimized_path)
+        size_after = size_before
+    note = f"Image compression: {size_before / (1024 * 1024):.1f}MB → {size_after / (1024 * 1024):.1f}MB"
+    logging.info(f"{os.path.basename(input_path)}: {note}")
+    return note
+
+
+def link_copy(input_path, file_name):
+    # Each target gets its own path to the same bytes, so every job can clean up after itself
+    path = temp_path(file_name)
+    try:
+        os.link(input_path, path)
+    except OSError:
+        shutil.copyfile(input_path, path)
+    return path
+
+
+def _translate_to_cache(file_name, input_path, file_hash, target_language, on_progress=None, source_language=None):
+    output_path = os.path.join(get_settings().output_dir, f"{uuid.uuid4().hex}_{target_language}_{file_name}")
+    try:
+        translate_document_file(input_path, output_path, target_language, on_progress, source_language)
+
+        # Keep the result so the next request for these bytes skips DeepL
+        cached_path = get_document_cache().put(file_hash, target_language, output_path)
+        if cached_path:
+            return cached_path, False
+        return output_path, True
+    except Exception:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+
+def translate_saved_document(file_name, input_path, file_hash, target_language, on_progress=None, source_language=None):
+    """Translate a saved upload that this call owns and return (download_path, is_temporary).
+
+    Identical requests (same content hash and target) that arrive while one is already
+    running wait for it and share its cached result instead of calling DeepL again.
+    """
+    def report(fraction, message):
+        if on_progress:
+            on_progress(fraction, message)
+
+    try:
+        report(0.0, "Waiting to start...")
+        flight_key = (file_hash, target_language)
+        (download_path, is_temporary), shared = get_document_flights().do(
+            flight_key, lambda: _translate_to_cache(
+                file_name, input_path, file_hash, target_language, on_progress, source_language
+            )
+        )
+        if shared:
+            logging.info(f"Shared an in-flight translation of {file_name} ({target_language})")
+            if is_temporary:
+                # The leader owns a result that was too big to cache, so translate our own copy
+                download_path, is_temporary = _translate_to_cache(
+                    file_name, input_path, file_hash, target_language, on_progress, source_language
+                )
+
+        report(1.0, "Translation complete! Preparing download...")
+        return download_path, is_temporary
+    finally:
+        # Clean up temporary files
+        try:
+            if os.path.exists(input_path):
+                os.remove(input_path)
+        except Exception as e:
+            logging.error(f"Error cleaning up temporary files: {str(e)}")
+
+
+def keep_result(owner, file_name, target_language, path, is_temporary, artifact_id=None):
+    """Add a finished translation to the user's recent results and return (path, is_temporary) to serve."""
+    try:
+        # Temporary outputs are handed over, cached ones are linked
+        artifact_path = get_artifact_store().put(
+            owner, file_name, target_language, path, artifact_id=artifact_id, move=is_temporary
+        )
+        return artifact_path, False
+    except Exception as e:
+        logging.error(f"Could not keep {file_name} ({target_language}) for re-download: {str(e)}")
+        return path, is_temporary
+
+
+def cache_job_output(job, output_path):
+    return get_document_cache().put(job["file_hash"], job["target_lang"], output_path)
+
+
+def keep_job_output(job, path, owned):
+    if job["keep_output"] == 0:
+        # Archive entries are collected into the archive's zip instead
+        return path
+    # The job ID doubles as the artifact ID, so the job's download points at the artifact
+    path, _ = keep_result(job["owner"], job["file_name"], job["target_lang"], path, owned, artifact_id=job["job_id"])
+    return path
+
+
+def discard_job_output(job):
+    # A job's own output (one too big for the document cache) is removed; a cached one stays
+    path = job["output_path"]
+    if path and os.path.dirname(os.path.abspath(path)) == os.path.abspath(get_settings().output_dir):
+        _remove_quietly(path)
+
+
+def get_job_manager():
+    # The document job queue; the app and worker.py processes each open it once.
+    # job_workers threads in this process run its jobs (none when only enqueueing).
+    settings = get_settings()
+    return _resource("job_manager", lambda: DocumentJobManager(
+        os.path.join(settings.cache_dir, "document_jobs.sqlite3"),
+        settings.output_dir,
+        translate_document=translate_document,
+        on_complete=cache_job_output,
+        on_done=keep_job_output,
+        max_workers=settings.job_workers,
+        lease_seconds=settings.job_lease_seconds,
+        max_attempts=settings.job_max_attempts,
+        retry_delay=settings.job_retry_delay,
+        per_user=settings.user_concurrency,
+        weight=get_admission().weight
+    ))
+
+
+def hash_file(path):
+    with open(path, "rb") as f:
+        return hash_stream(f)
+
+
+def translate_path(input_path, output_path, target_language, optimize_images=False):
+    """Translate a file on disk into output_path, going through the document cache.
+
+    Returns True if the translation came from the cache.
+    """
+    ensure_work_dirs()
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+
+    file_name = os.path.basename(input_path)
+    file_hash = cache_hash_for(hash_file(input_path), optimize_images)
+    cached_path = get_document_cache().get(file_hash, target_language)
+    if cached_path:
+        shutil.copyfile(cached_path, output_path)
+        return True
+
+    # Work on a private copy so preprocessing never touches the caller's file
+    working_path = temp_path(file_name)
+    shutil.copyfile(input_path, working_path)
+    try:
+        preprocess_document(working_path, optimize_images)
+    except Exception:
+        os.remove(working_path)
+        raise
+    result_path, is_temporary = translate_saved_document(file_name, working_path, file_hash, target_language)
+    if is_temporary:
+        shutil.move(result_path, output_path)
+    else:
+        shutil.copyfile(result_path, output_path)
+    return False
+
+
+# Zip archives
+
+class ArchiveTooLarge(Exception):
+    pass
+
+
+def archive_entries(archive):
+    """Return the entries of an open zip that can be translated, skipping folders and OS metadata."""
+    entries = []
+    for info in archive.infolist():
+        base_name = os.path.basename(info.filename)
+        if info.is_dir() or info.filename.startswith("__MACOSX/") or base_name.startswith("."):
+            continue
+        if os.path.splitext(base_name)[1].lower() in SUPPORTED_EXTENSIONS:
+            entries.append(info)
+    return entries
+
+
+def check_archive(entries):
+    """Raise ArchiveTooLarge if the entries would unpack into more than the settings allow.
+
+    zipfile never reads more than an entry's declared size, so checking the declared
+    sizes up front is enough to stop a zip bomb before anything is extracted.
+    """
+    settings = get_settings()
+    if len(entries) > settings.archive_max_entries:
+        raise ArchiveTooLarge(f"The archive has {len(entries)} documents; at most {settings.archive_max_entries} are allowed")
+    total = sum(info.file_size for info in entries)
+    if total > settings.archive_max_mb * 1024 * 1024:
+        raise ArchiveTooLarge(
+            f"The archive unpacks to {total / (1024 * 1024):.0f}MB; at most {settings.archive_max_mb}MB is allowed"
+        )
+    for info in entries:
+        # Small text files can legitimately compress very well
+        if info.file_size > 1024 * 1024 and info.file_size > settings.archive_max_ratio * max(info.compress_size, 1):
+            raise ArchiveTooLarge(f"{info.filename} is compressed suspiciously well and was not unpacked")
+
+
+def archive_name(name):
+    # Keep the folder layout, but never let an entry point outside the result zip's root
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    return "/".join(parts)
+
+
+def unique_name(name, used):
+    # Entries that end up with the same name ("a/../b.pdf" and "b.pdf") get a numbered suffix
+    base, extension = os.path.splitext(name)
+    candidate = name
+    number = 2
+    while candidate.lower() in used:
+        candidate = f"{base} ({number}){extension}"
+        number += 1
+    used.add(candidate.lower())
+    return candidate
+
+
+def extract_entry(archive, info, directory):
+    """Copy one zip entry to a file in directory, without reading it into memory, and return its path."""
+    path = os.path.join(directory, f"{uuid.uuid4().hex}_{os.path.basename(info.filename)}")
+    with metrics.span("archive_extract", format=metrics.file_format(info.filename)):
+        with archive.open(info) as source, open(path, "wb") as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+    return path
+
+
+def _remove_quietly(path):
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except OSError as e:
+        logging.error(f"Error cleaning up temporary files: {str(e)}")
+
+
+def translate_archive(source, output_path, target_languages, owner, optimize_images=False, on_progress=None,
+                      skip_same_language=True, poll_interval=0.5):
+    """Translate every supported document in a zip into each target and write the results to a zip.
+
+    source is a path or a binary file object. Each entry becomes a job in owner's name
+    on the document job queue, so archives share the workers fairly with everyone
+    else's documents and count against owner's USER_CONCURRENCY and character rate.
+    Entries are extracted and queued a few at a time as jobs finish, so only a few
+    extracted files sit on disk at once, and each translation is written to
+    output_path as <target>/<original path> as soon as it is done.
+    on_progress(fraction, message) runs on the calling thread. Failures are listed in
+    errors.txt inside the zip. Returns counts of "translated", "from_cache",
+    "skipped" (already in the target language) and "failed" files. Raises
+    ArchiveTooLarge, before extracting anything, for archives over the
+    ARCHIVE_MAX_* limits. output_path is removed again if the run does not finish.
+    """
+    ensure_work_dirs()
+    settings = get_settings()
+    job_manager = get_job_manager()
+    document_cache = get_document_cache()
+    # Enough queued jobs to use the owner's whole share, without extracting the whole archive
+    window = max(2, settings.user_concurrency * 2)
+    summary = {"translated": 0, "from_cache": 0, "skipped": 0, "failed": 0}
+    errors = []
+    # (job ID, arcname); identical entries share a job, so a job may appear more than once
+    pending = []
+    used_names = set()
+    started = time.time()
+
+    # Extracted entries live in a directory of their own, removed however the run ends
+    with zipfile.ZipFile(source) as archive, tempfile.TemporaryDirectory(dir=settings.temp_dir) as work_dir:
+        entries = archive_entries(archive)
+        check_archive(entries)
+        total = len(entries) * len(target_languages)
+
+        def report():
+            if on_progress and total:
+                done = sum(summary.values())
+                message = f"{done} of {total} translations done"
+                if done and done < total:
+                    elapsed = time.time() - started
+                    message += f", about {format_duration(elapsed / done * (total - done))} left"
+                on_progress(done / total, message)
+
+        def fail(arcname, e):
+            logging.error(f"Archive entry {arcname} failed: {str(e)}")
+            errors.append(f"{arcname}: {str(e)}")
+            summary["failed"] += 1
+
+        def collect(output, limit):
+            # Wait until at most limit jobs are left. Results are written from this
+            # thread only; ZipFile is not thread-safe.
+            while len(pending) > limit:
+                jobs = {}
+                for job_id, arcname in list(pending):
+                    job = jobs.get(job_id) or job_manager.get(job_id)
+                    jobs[job_id] = job
+                    if not job or job["state"] == "error":
+                        pending.remove((job_id, arcname))
+                        fail(arcname, job["error"] if job else "The translation job disappeared")
+                    elif job["state"] == "done":
+                        pending.remove((job_id, arcname))
+                        try:
+                            output.write(job["output_path"], arcname)
+                            summary["translated"] += 1
+                        except Exception as e:
+                            fail(arcname, e)
+                        finally:
+                            if not any(other == job_id for other, _ in pending):
+                                discard_job_output(job)
+                report()
+                if len(pending) > limit:
+                    time.sleep(poll_interval)
+
+        def queue(output, name, input_path):
+            file_name = os.path.basename(name)
+            # The cache key comes from the bytes as uploaded, as for single documents
+            file_hash = cache_hash_for(hash_file(input_path), optimize_images)
+            preprocess_document(input_path, optimize_images)
+            source_language = detect_document_language(input_path, file_name, file_hash, target_languages[0])
+            missing = []
+            for target_language in target_languages:
+                arcname = f"{target_language}/{name}"
+                try:
+                    if same_language(source_language, target_language) and skip_same_language:
+                        summary["skipped"] += 1
+                        continue
+                    cached_path = document_cache.get(file_hash, target_language)
+                    if cached_path:
+                        output.write(cached_path, arcname)
+                        summary["from_cache"] += 1
+                    else:
+                        missing.append(target_language)
+                except Exception as e:
+                    fail(arcname, e)
+            if not missing:
+                return
+            try:
+                # Refused up front, as for single uploads, rather than failing every job once the quota runs out
+                check_document_quota(input_path, copies=len(missing))
+            except Exception as e:
+                for target_language in missing:
+                    fail(f"{target_language}/{name}", e)
+                return
+            characters = estimate_document_characters(input_path)
+            for target_language in missing:
+                arcname = f"{target_language}/{name}"
+                try:
+                    collect(output, window - 1)
+                    copy_path = link_copy(input_path, file_name)
+                    try:
+                        job_id = job_manager.submit(
+                            owner, file_name, file_hash, target_language, copy_path,
+                            source_lang=None if same_language(source_language, target_language) else source_language,
+                            # Held back while the owner is over their character rate
+                            not_before=get_admission().schedule(owner, characters),
+                            # Only needed until it is in the zip
+                            keep_output=False
+                        )
+                    finally:
+                        _remove_quietly(copy_path)
+                    pending.append((job_id, arcname))
+                except Exception as e:
+                    fail(arcname, e)
+
+        try:
+            with zipfile.ZipFile(output_path, "w", zipfile.ZIP_STORED) as output:
+                report()
+                for info in entries:
+                    name = unique_name(archive_name(info.filename), used_names)
+                    input_path = None
+                    try:
+                        input_path = extract_entry(archive, info, work_dir)
+                        queue(output, name, input_path)
+                    except Exception as e:
+                        for target_language in target_languages:
+                            fail(f"{target_language}/{name}", e)
+                    finally:
+                        if input_path:
+                            _remove_quietly(input_path)
+                    report()
+
+                collect(output, 0)
+                if errors:
+                    output.writestr("errors.txt", "\n".join(errors) + "\n")
+        except BaseException:
+            # Including Streamlit stopping the script for a rerun, which is not an Exception
+            _remove_quietly(output_path)
+            raise
+    return summary
@@ -0,0 +1,54 @@
+import io
+import logging
+import os
+import zipfile
+
+from PIL import Image
+
+OPTIMIZABLE_EXTENSIONS = (".docx", ".pptx")
+MEDIA_PREFIXES = ("word/media/", "ppt/media/")
+IMAGE_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG"}
+
+
+def can_optimize(path):
+    return os.path.splitext(path)[1].lower() in OPTIMIZABLE_EXTENSIONS
+
+
+def _recompress(data, image_format, max_dimension, jpeg_quality):
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        if max(image.size) > max_dimension:
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        output = io.BytesIO()
+        if image_format == "JPEG":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(output, "JPEG", quality=jpeg_quality, optimize=True, progressive=True)
+        else:
+            image.save(output, "PNG", optimize=True)
+        return output.getvalue()
+
+
+def optimize_office_images(input_path, output_path, max_dimension=1600, jpeg_quality=80):
+    """Downscale and recompress the images embedded in a DOCX/PPTX file.
+
+    Images keep their file names and formats so the document's relationships stay
+    valid; an image is only replaced when the recompressed copy is smaller.
+    Returns (size_before, size_after) in bytes.
+    """
+    size_before = os.path.getsize(input_path)
+    with zipfile.ZipFile(input_path) as source, zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            data = source.read(item.filename)
+            extension = os.path.splitext(item.filename)[1].lower()
+            if item.filename.startswith(MEDIA_PREFIXES) and extension in IMAGE_FORMATS:
+                try:
+                    smaller = _recompress(data, IMAGE_FORMATS[extension], max_dimension, jpeg_quality)
+                    if len(smaller) < len(data):
+                        data = smaller
+                except Exception as e:
+                    logging.warning(f"Could not recompress {item.filename}: {str(e)}")
+            # Images are already compressed, storing them avoids a pointless deflate pass
+            compress_type = zipfile.ZIP_STORED if extension in IMAGE_FORMATS else zipfile.ZIP_DEFLATED
+            target.writestr(item, data, compress_type=compress_type)
+    return size_before, os.path.getsize(output_path)
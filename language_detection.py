@@ -0,0 +1,124 @@
+import html
+import os
+import re
+import sqlite3
+import threading
+import time
+import zipfile
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pypdf is optional, PDFs are left to DeepL's detection without it
+    PdfReader = None
+
+SAMPLE_PDF_PAGES = 2
+
+OFFICE_PARAGRAPH_END = re.compile(r"</[wa]:p>")
+OFFICE_TEXT = re.compile(r"<[wa]:t(?:\s[^>]*)?>([^<]*)</[wa]:t>")
+SLIDE_NAME = re.compile(r"ppt/slides/slide(\d+)\.xml")
+
+
+def base_language(code):
+    # EN-US, EN-GB -> EN; DeepL reports detected languages without the variant
+    return code.split("-")[0].upper() if code else None
+
+
+def same_language(source_language, target_language):
+    return bool(source_language) and base_language(source_language) == base_language(target_language)
+
+
+def _office_text(xml, max_chars):
+    paragraphs = []
+    length = 0
+    for chunk in OFFICE_PARAGRAPH_END.split(xml):
+        paragraph = html.unescape("".join(OFFICE_TEXT.findall(chunk))).strip()
+        if paragraph:
+            paragraphs.append(paragraph)
+            length += len(paragraph)
+            if length >= max_chars:
+                break
+    return paragraphs
+
+
+def _sample_office(source, names, max_chars):
+    paragraphs = []
+    with zipfile.ZipFile(source) as archive:
+        for name in names(archive.namelist()):
+            paragraphs += _office_text(archive.read(name).decode("utf-8", errors="ignore"), max_chars)
+            if sum(len(paragraph) for paragraph in paragraphs) >= max_chars:
+                break
+    return "\n\n".join(paragraphs)
+
+
+def _document_body(names):
+    return [name for name in names if name == "word/document.xml"]
+
+
+def _slides_in_order(names):
+    slides = []
+    for name in names:
+        match = SLIDE_NAME.fullmatch(name)
+        if match:
+            slides.append((int(match.group(1)), name))
+    return [name for _, name in sorted(slides)]
+
+
+def extract_sample(source, file_name, max_chars=1000):
+    """Return up to about max_chars of text from the start of a document, or "".
+
+    source is a path or a binary file object (rewound before and after reading).
+    Only the first pages of a PDF and the first paragraphs of a DOCX/PPTX are read;
+    PDFs give "" when pypdf is not installed.
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    if hasattr(source, "seek"):
+        source.seek(0)
+    try:
+        if extension == ".txt":
+            if hasattr(source, "read"):
+                data = source.read(max_chars * 4)
+            else:
+                with open(source, "rb") as f:
+                    data = f.read(max_chars * 4)
+            text = data.decode("utf-8-sig", errors="ignore")
+        elif extension == ".docx":
+            text = _sample_office(source, _document_body, max_chars)
+        elif extension == ".pptx":
+            text = _sample_office(source, _slides_in_order, max_chars)
+        elif extension == ".pdf" and PdfReader is not None:
+            reader = PdfReader(source)
+            text = "\n\n".join(page.extract_text() or "" for page in reader.pages[:SAMPLE_PDF_PAGES])
+        else:
+            text = ""
+    finally:
+        if hasattr(source, "seek"):
+            source.seek(0)
+    return text.strip()[:max_chars]
+
+
+class LanguageCache:
+    """Detected source language per content hash, so a file is only sampled once."""
+
+    def __init__(self, db_path):
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS languages (content_hash TEXT PRIMARY KEY, language TEXT NOT NULL, detected_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, content_hash):
+        with self._lock:
+            row = self._conn.execute("SELECT language FROM languages WHERE content_hash = ?", (content_hash,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, content_hash, language):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO languages (content_hash, language, detected_at) VALUES (?, ?, ?)",
+                (content_hash, language, time.time())
+            )
+            self._conn.commit()
@@ -0,0 +1,202 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, entry):
+                    lines.append(f"{self.name}_bucket{_label_text(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', '+Inf'),))} {entry[-1]}")
+                lines.append(f"{self.name}_sum{_label_text(key)} {entry[-2]:.6f}")
+                lines.append(f"{self.name}_count{_label_text(key)} {entry[-1]}")
+        return lines
+
+
+class Registry:
+    """Holds the process's metrics and renders them in the Prometheus text format.
+
+    Collectors are callables returning (name, type, help, labels, value) samples,
+    used for figures that other components already count themselves.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text):
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        families = {}
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                logging.error(f"Metrics collector failed: {str(e)}")
+                continue
+            for name, metric_type, help_text, labels, value in samples:
+                family = families.setdefault(name, (metric_type, help_text, []))
+                family[2].append((tuple(sorted(labels.items())), value))
+        for name, (metric_type, help_text, samples) in families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for key, value in samples:
+                lines.append(f"{name}{_label_text(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+PHASE_SECONDS = REGISTRY.histogram("translator_phase_seconds", "Time spent in each processing phase")
+DOCUMENTS = REGISTRY.counter("translator_documents_total", "Documents translated, by format and target language")
+DOCUMENT_BYTES = REGISTRY.counter("translator_document_bytes_total", "Bytes of source documents translated")
+TEXT_CHARACTERS = REGISTRY.counter("translator_text_characters_total", "Characters of pasted text translated")
+DOCUMENT_SEGMENTS = REGISTRY.counter("translator_document_segments_total", "Segments of revised documents, by source (memory or deepl)")
+ADMISSION_WAIT = REGISTRY.histogram("translator_admission_wait_seconds", "Time text requests waited for their user's fair share, by size")
+GRAPH_PROFILE_LOOKUPS = REGISTRY.counter("translator_graph_profile_lookups_total", "Signed-in user profile lookups, by cache result")
+
+
+def file_format(path):
+    return os.path.splitext(path)[1].lower().lstrip(".") or "unknown"
+
+
+@contextmanager
+def span(phase, **labels):
+    """Time a block of work and record it under translator_phase_seconds."""
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        PHASE_SECONDS.observe(time.perf_counter() - start, phase=phase, outcome=outcome, **labels)
+
+
+def record_document(input_path, target_lang):
+    labels = {"format": file_format(input_path), "target_lang": target_lang}
+    DOCUMENTS.inc(**labels)
+    DOCUMENT_BYTES.inc(os.path.getsize(input_path), **labels)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the application log
+        pass
+
+
+def start_http_server(port, address="0.0.0.0"):
+    """Serve /metrics on a background thread and return the server."""
+    server = ThreadingHTTPServer((address, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"Serving metrics on port {port}")
+    return server
+
+
+def write_dump(path):
+    # Written to a temporary name first so readers never see a half-written file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(REGISTRY.render())
+    os.replace(temp_path, path)
+
+
+def start_dump(path, interval=60):
+    """Rewrite the metrics file every interval seconds on a background thread."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_dump(path)
+            except Exception as e:
+                logging.error(f"Could not write metrics to {path}: {str(e)}")
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    threading.Thread(target=loop, name="metrics-dump", daemon=True).start()
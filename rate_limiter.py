@@ -0,0 +1,167 @@
+import logging
+import random
+import threading
+import time
+
+import deepl
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# DeepL bills PDF/DOCX/PPTX uploads at no less than this many characters
+MIN_DOCUMENT_CHARACTERS = 50000
+
+
+class TokenBucket:
+    """Thread-safe token bucket; callers block until enough tokens have refilled."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._priority_waiting = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount=1, priority=False):
+        """Take amount tokens, waiting for them if needed, and return the seconds waited.
+
+        While a priority caller is waiting, other callers hold back, so interactive
+        requests go ahead of bulk work.
+        """
+        if not self.rate:
+            return 0.0
+        # A request larger than the bucket would never fit, so it just drains it
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        if priority:
+            with self._lock:
+                self._priority_waiting += 1
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    self._refill(now)
+                    yielding = not priority and self._priority_waiting
+                    if now >= self._paused_until and self._tokens >= amount and not yielding:
+                        self._tokens -= amount
+                        return waited
+                    delay = max(self._paused_until - now, (amount - self._tokens) / self.rate)
+                    if yielding:
+                        delay = max(delay, 1 / self.rate)
+                time.sleep(delay)
+                waited += delay
+        finally:
+            if priority:
+                with self._lock:
+                    self._priority_waiting -= 1
+
+    def pause(self, seconds):
+        """Hold back every caller for a while, e.g. after the server said we are too fast."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class DeepLScheduler:
+    """Paces every DeepL call and keeps an eye on the account's character quota.
+
+    Calls take a token from a shared request bucket (and characters from a
+    character bucket), so bursts queue up instead of hitting 429s; interactive
+    calls take theirs ahead of bulk document work. Rate-limit and
+    5xx responses are retried with jittered exponential backoff and pause the whole
+    bucket, and large requests are checked against the last known usage before
+    they are sent.
+    """
+
+    def __init__(self, call, requests_per_second=10, characters_per_second=0, max_attempts=4,
+                 base_delay=1.0, max_delay=30.0, usage_check_interval=60):
+        self._call = call
+        self.requests = TokenBucket(requests_per_second, capacity=requests_per_second * 2)
+        self.characters = TokenBucket(characters_per_second)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.usage_check_interval = usage_check_interval
+        self._lock = threading.Lock()
+        self._usage = None
+        self._usage_checked = 0.0
+        self._characters_since_check = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+
+    def _retryable(self, e):
+        if isinstance(e, (deepl.QuotaExceededException, deepl.DocumentNotReadyException)):
+            return False
+        return isinstance(e, deepl.TooManyRequestsException) or getattr(e, "http_status_code", None) in RETRYABLE_STATUS_CODES
+
+    def _backoff(self, attempt):
+        # Full jitter, so callers that failed together do not retry together
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, characters=0, interactive=False):
+        """Run fn(client) through the pool once the rate limits allow it, retrying transient errors."""
+        for attempt in range(self.max_attempts):
+            waited = self.requests.acquire(priority=interactive)
+            if characters:
+                waited += self.characters.acquire(characters, priority=interactive)
+            if waited:
+                with self._lock:
+                    self.throttled_seconds += waited
+            try:
+                result = self._call(fn, interactive=interactive)
+            except deepl.DeepLException as e:
+                if attempt == self.max_attempts - 1 or not self._retryable(e):
+                    raise
+                delay = self._backoff(attempt)
+                if isinstance(e, deepl.TooManyRequestsException):
+                    self.requests.pause(delay)
+                with self._lock:
+                    self.retries += 1
+                logging.warning(f"DeepL request failed ({str(e)}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            with self._lock:
+                self._characters_since_check += characters
+            return result
+
+    def _refresh_usage(self):
+        self._usage_checked = time.time()
+        try:
+            usage = self._call(lambda translator: translator.get_usage())
+        except deepl.DeepLException as e:
+            # Not knowing the usage should not stop translations
+            logging.warning(f"Could not read DeepL usage: {str(e)}")
+            return
+        with self._lock:
+            self._usage = usage
+            self._characters_since_check = 0
+
+    def check_quota(self, characters):
+        """Raise QuotaExceededException if sending this many characters would exceed the account limit."""
+        if time.time() - self._usage_checked > self.usage_check_interval:
+            self._refresh_usage()
+        with self._lock:
+            usage = self._usage
+            pending = self._characters_since_check
+        if usage is None or not usage.character.valid:
+            return
+        remaining = usage.character.limit - usage.character.count - pending
+        if remaining < characters:
+            raise deepl.QuotaExceededException(
+                f"Not enough DeepL quota left: about {max(remaining, 0)} characters remain "
+                f"and this request needs up to {characters}"
+            )
+
+    def stats(self):
+        with self._lock:
+            usage = self._usage
+        return {
+            "retries": self.retries,
+            "throttled_seconds": round(self.throttled_seconds, 1),
+            "character_usage": str(usage.character) if usage else None,
+        }
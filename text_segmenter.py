@@ -0,0 +1,97 @@
+import re
+
+# DeepL accepts up to 50 texts and 128 KiB of request body per translate_text call;
+# stay a little under the byte limit to leave room for the other form fields
+MAX_BATCH_TEXTS = 50
+MAX_BATCH_BYTES = 120 * 1024
+MAX_SEGMENT_CHARS = 5000
+
+PARAGRAPH_BREAK = re.compile(r"(\n\s*\n)")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?。！？])(\s+)")
+
+
+def _split_long(paragraph, max_chars):
+    # Break an oversized paragraph at sentence ends, then hard-wrap anything still too long
+    pieces = []
+    current = ""
+    for part in SENTENCE_BREAK.split(paragraph):
+        if len(current) + len(part) > max_chars and current:
+            pieces.append(current)
+            current = ""
+        current += part
+    if current:
+        pieces.append(current)
+
+    result = []
+    for piece in pieces:
+        while len(piece) > max_chars:
+            cut = piece.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            result.append(piece[:cut])
+            piece = piece[cut:]
+        result.append(piece)
+    return result
+
+
+def _append(parts, piece):
+    # Keep surrounding whitespace out of the segment so equal paragraphs dedupe
+    # and the original spacing survives translation
+    stripped = piece.strip()
+    if not stripped:
+        parts.append((piece, False))
+        return
+    start = piece.index(stripped)
+    end = start + len(stripped)
+    if start:
+        parts.append((piece[:start], False))
+    parts.append((stripped, True))
+    if end < len(piece):
+        parts.append((piece[end:], False))
+
+
+def split_segments(text, max_chars=MAX_SEGMENT_CHARS):
+    """Split text into a list of (piece, translatable) tuples.
+
+    Joining every piece in order gives back the original text, so translated
+    segments can be reassembled with the original paragraph spacing.
+    """
+    parts = []
+    for block in PARAGRAPH_BREAK.split(text):
+        if not block:
+            continue
+        if len(block) <= max_chars:
+            _append(parts, block)
+            continue
+        for piece in _split_long(block, max_chars):
+            _append(parts, piece)
+    return parts
+
+
+def unique_segments(parts):
+    seen = {}
+    for piece, translatable in parts:
+        if translatable and piece not in seen:
+            seen[piece] = None
+    return list(seen)
+
+
+def make_batches(segments, max_texts=MAX_BATCH_TEXTS, max_bytes=MAX_BATCH_BYTES):
+    batches = []
+    current = []
+    current_bytes = 0
+    for segment in segments:
+        size = len(segment.encode("utf-8"))
+        if current and (len(current) >= max_texts or current_bytes + size > max_bytes):
+            batches.append(current)
+            current = []
+            current_bytes = 0
+        current.append(segment)
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def reassemble(parts, translations):
+    return "".join(translations[piece] if translatable else piece for piece, translatable in parts)
@@ -0,0 +1,185 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+import msal
+from cryptography.fernet import Fernet, InvalidToken
+
+
+def _fernet(secret):
+    # Accept a ready-made Fernet key, otherwise derive one from the given secret
+    try:
+        return Fernet(secret)
+    except (ValueError, TypeError):
+        return Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret.encode("utf-8")).digest()))
+
+
+def _session_hash(session_id):
+    return hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+
+
+def _by_account(state):
+    # {home account ID: {section: {key: entry}}}; entries of no account (app metadata) go under ""
+    accounts = {}
+    for section, entries in state.items():
+        for key, entry in entries.items():
+            account = accounts.setdefault(entry.get("home_account_id") or "", {})
+            account.setdefault(section, {})[key] = entry
+    return accounts
+
+
+class TokenStore:
+    """Encrypted on-disk home for the MSAL token cache and the login sessions that use it.
+
+    The serialized MSAL cache (access, refresh and ID tokens) is encrypted with Fernet
+    before it is written to SQLite, so tokens survive restarts without sitting on disk
+    in the clear. Several app processes may share the store: save() merges per account,
+    so one process writing its cache never drops accounts another process signed in
+    or refreshed. A login session maps an opaque random ID held by the browser to the
+    MSAL account it signed in as; only a hash of the ID is stored, and each ID can be
+    redeemed once for a fresh one.
+    """
+
+    def __init__(self, db_path, secret, session_ttl=24 * 3600):
+        if not secret:
+            raise ValueError("A secret is needed to encrypt the token cache")
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.session_ttl = session_ttl
+        self._fernet = _fernet(secret)
+        self._lock = threading.Lock()
+        self._loaded_at = 0.0
+        # Per-account entries as last read or written, to tell which accounts this process changed
+        self._synced = {}
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_cache (id INTEGER PRIMARY KEY CHECK (id = 1), data BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session_hash TEXT PRIMARY KEY, home_account_id TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.cache = msal.SerializableTokenCache()
+        self.reload()
+
+    def reload(self):
+        """Pick up the stored cache if another process has written a newer one."""
+        with self._lock:
+            row = self._conn.execute("SELECT data, updated_at FROM token_cache WHERE id = 1").fetchone()
+            if row is None or row[1] <= self._loaded_at:
+                return
+            self._load(self._decrypt(row[0]))
+            self._loaded_at = row[1]
+
+    def _decrypt(self, data):
+        try:
+            return json.loads(self._fernet.decrypt(data).decode("utf-8"))
+        except InvalidToken:
+            # Written with another key, e.g. after the secret was rotated
+            logging.warning("Stored MSAL token cache could not be decrypted, starting with an empty cache")
+            return {}
+
+    def _load(self, state):
+        self.cache.deserialize(json.dumps(state))
+        self.cache.has_state_changed = False
+        self._synced = _by_account(state)
+
+    def save(self):
+        """Write the accounts this process changed into the stored cache, keeping everyone else's."""
+        with self._lock:
+            if not self.cache.has_state_changed:
+                return
+            # IMMEDIATE takes the write lock up front, so no other process writes between our read and write
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT data FROM token_cache WHERE id = 1").fetchone()
+                stored = _by_account(self._decrypt(row[0])) if row else {}
+                ours = _by_account(json.loads(self.cache.serialize()))
+                for account in set(ours) | set(self._synced):
+                    if ours.get(account) != self._synced.get(account):
+                        if account in ours:
+                            stored[account] = ours[account]
+                        else:
+                            # Signed out here
+                            stored.pop(account, None)
+                merged = {}
+                for sections in stored.values():
+                    for section, entries in sections.items():
+                        merged.setdefault(section, {}).update(entries)
+                now = time.time()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO token_cache (id, data, updated_at) VALUES (1, ?, ?)",
+                    (self._fernet.encrypt(json.dumps(merged).encode("utf-8")), now)
+                )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            self._load(merged)
+            self._loaded_at = now
+
+    def create_session(self, home_account_id):
+        session_id = secrets.token_urlsafe(32)
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+            self._conn.execute(
+                "INSERT INTO sessions (session_hash, home_account_id, expires_at) VALUES (?, ?, ?)",
+                (_session_hash(session_id), home_account_id, time.time() + self.session_ttl)
+            )
+            self._conn.commit()
+        return session_id
+
+    def redeem_session(self, session_id):
+        """Swap a live session ID for a new one and return (new session ID, home account ID), or (None, None).
+
+        The old ID stops working at once, so an ID that leaked from a URL (browser
+        history, proxy logs, a shared link) is useless after the browser's next visit.
+        """
+        key = _session_hash(session_id)
+        new_id = secrets.token_urlsafe(32)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT home_account_id FROM sessions WHERE session_hash = ? AND expires_at >= ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute("DELETE FROM sessions WHERE session_hash = ?", (key,))
+                    self._conn.execute(
+                        "INSERT INTO sessions (session_hash, home_account_id, expires_at) VALUES (?, ?, ?)",
+                        (_session_hash(new_id), row[0], now + self.session_ttl)
+                    )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        if row is None:
+            return None, None
+        return new_id, row[0]
+
+    def get_session(self, session_id):
+        """Return the home account ID for a live session, extending its expiry, or None."""
+        key = _session_hash(session_id)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT home_account_id FROM sessions WHERE session_hash = ? AND expires_at >= ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE sessions SET expires_at = ? WHERE session_hash = ?", (now + self.session_ttl, key))
+            self._conn.commit()
+            return row[0]
+
+    def delete_session(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_hash = ?", (_session_hash(session_id),))
+            self._conn.commit()
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    # Treat copies of the same paragraph as equal regardless of line endings,
+    # unicode composition or surrounding whitespace
+    text = unicodedata.normalize("NFC", text)
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text.strip()
+
+
+def make_key(text, target_lang, **options):
+    payload = json.dumps(
+        {
+            "text": normalize_text(text),
+            "target_lang": target_lang.upper(),
+            "options": {k: v for k, v in sorted(options.items()) if v is not None},
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TranslationMemory:
+    """In-process LRU in front of a persistent SQLite store of text translations.
+
+    Expired and surplus rows are removed every evict_interval writes rather than on
+    each one, so the store may briefly hold a few more than max_disk_entries.
+    """
+
+    def __init__(self, db_path, max_memory_entries=1024, max_disk_entries=100000, ttl_seconds=30 * 24 * 3600,
+                 evict_interval=256):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.evict_interval = evict_interval
+        # Writes since the last eviction; starts due so a new process trims what it inherits
+        self._writes = evict_interval
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS translations (
+                key TEXT PRIMARY KEY,
+                target_lang TEXT NOT NULL,
+                translated_text TEXT NOT NULL,
+                detected_source_lang TEXT,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_translations_accessed ON translations (accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_translations_created ON translations (created_at)")
+        self._conn.commit()
+
+    def _expired(self, created_at, now):
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry["created_at"], now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry
+                del self._memory[key]
+
+            row = self._conn.execute(
+                "SELECT translated_text, detected_source_lang, created_at FROM translations WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if self._expired(row[2], now):
+                self._conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE translations SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            entry = {"text": row[0], "detected_source_lang": row[1], "created_at": row[2]}
+            self._remember(key, entry)
+            self.disk_hits += 1
+            return entry
+
+    def put(self, key, target_lang, translated_text, detected_source_lang=None):
+        self.put_many([(key, translated_text, detected_source_lang)], target_lang)
+
+    def put_many(self, entries, target_lang):
+        """Store [(key, translated_text)] or [(key, translated_text, detected_source_lang)] in one transaction."""
+        now = time.time()
+        rows = [(entry[0], target_lang, entry[1], entry[2] if len(entry) > 2 else None, now, now) for entry in entries]
+        with self._lock:
+            for key, _, translated_text, detected_source_lang, _, _ in rows:
+                self._remember(key, {"text": translated_text, "detected_source_lang": detected_source_lang, "created_at": now})
+            self._conn.executemany(
+                """
+                INSERT OR REPLACE INTO translations
+                    (key, target_lang, translated_text, detected_source_lang, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+            self._writes += len(rows)
+            if self._writes >= self.evict_interval:
+                self._evict_disk(now)
+                self._writes = 0
+            self._conn.commit()
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now):
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM translations WHERE created_at < ?", (now - self.ttl_seconds,))
+        count = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM translations WHERE key IN "
+                "(SELECT key FROM translations ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,),
+            )
+            logging.info(f"Translation memory evicted {overflow} least recently used entries")
+
+    def stats(self):
+        with self._lock:
+            disk_entries = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+            }
@@ -0,0 +1,112 @@
+"""Run document translation jobs outside the web app.
+
+Example:
+    python worker.py --processes 4 --threads 2
+
+Workers take jobs from the queue the app writes to (<CACHE_DIR>/document_jobs.sqlite3),
+so they need the same CACHE_DIR as the app: the same host, or a volume that supports
+SQLite locking. Start the app with JOB_WORKERS=0 so that it only enqueues jobs and
+reads their status. A worker that dies mid-job loses its lease after JOB_LEASE_SECONDS
+and another worker resumes the job; dead worker processes are restarted.
+
+With --metrics-port N (or WORKER_METRICS_PORT), worker process i serves its metrics on
+port N + i; METRICS_DUMP_PATH gets a ".worker-<i>" suffix per process.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run queued document translations with DeepL.")
+    parser.add_argument("--processes", "-p", type=int, default=2, help="Number of worker processes (default: 2)")
+    parser.add_argument("--threads", "-t", type=int, default=4, help="Jobs each process runs at the same time (default: 4)")
+    parser.add_argument("--grace", type=float, default=30, help="Seconds running jobs get to finish on shutdown (default: 30)")
+    parser.add_argument("--env-file", default="configs/app.env", help="Environment file with DEEPL_API_KEY (default: configs/app.env)")
+    parser.add_argument(
+        "--metrics-port", type=int, default=int(os.getenv("WORKER_METRICS_PORT", "0")),
+        help="Serve worker i's metrics on this port + i (default: WORKER_METRICS_PORT, or no endpoint)"
+    )
+    return parser.parse_args(argv)
+
+
+def run_worker(index, threads, grace, env_file, metrics_port):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(processName)s %(message)s")
+    logging.getLogger("deepl").setLevel(logging.WARNING)
+    load_dotenv(env_file)
+
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.set())
+
+    # Imported after the environment is loaded so the engine sees the configuration
+    import engine
+    settings = engine.get_settings()
+    # Every process needs its own port and dump file; the app's METRICS_PORT is not ours
+    engine.configure(
+        job_workers=threads, deepl_pool_size=max(threads * 2, settings.deepl_pool_size),
+        metrics_port=metrics_port + index if metrics_port else None,
+        metrics_dump_path=f"{settings.metrics_dump_path}.worker-{index}" if settings.metrics_dump_path else None
+    )
+    engine.ensure_work_dirs()
+    engine.start_metrics()
+    job_manager = engine.get_job_manager()
+    logging.info(f"Worker started with {threads} threads")
+
+    while not stopping.wait(5):
+        if not job_manager.healthy():
+            # The supervisor starts a fresh process; running jobs resume once their lease runs out
+            logging.error("Worker threads died, exiting so the worker is restarted")
+            sys.exit(1)
+    if not job_manager.stop(timeout=grace):
+        logging.warning("Worker stopped with jobs still running; they resume once their lease runs out")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    # A fresh interpreter per worker, so nothing from the supervisor (locks, threads) is inherited
+    context = multiprocessing.get_context("spawn")
+
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.set())
+
+    def start(index):
+        process = context.Process(
+            target=run_worker, args=(index, args.threads, args.grace, args.env_file, args.metrics_port),
+            name=f"worker-{index}"
+        )
+        process.start()
+        return process
+
+    processes = [start(index) for index in range(args.processes)]
+    logging.info(f"Started {args.processes} worker processes with {args.threads} threads each")
+    while not stopping.wait(1):
+        for index, process in enumerate(processes):
+            if not process.is_alive():
+                logging.error(f"{process.name} exited with code {process.exitcode}, restarting it")
+                processes[index] = start(index)
+                # Keep a worker that dies on startup from restarting in a tight loop
+                time.sleep(1)
+
+    logging.info("Stopping workers...")
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(args.grace + 5)
+        if process.is_alive():
+            process.kill()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())